@@ -0,0 +1,38 @@
+"""Size and time of /repos responses, with and without `fields`.
+
+    python -m benchmarks.bench_fields
+"""
+
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from devops_console_rest_api.models.bitbucket import Repository
+from devops_console_rest_api.serialization import dumps_listing, parse_fields
+
+from .catalog import make_catalog
+
+FIELDS = "name,uuid,project.key,updated_on"
+
+
+def main(n: int = 1000, number: int = 20):
+    repos = make_catalog(n)
+    include = parse_fields(FIELDS, Repository)
+
+    cases = {
+        # what FastAPI does for the full list (no response_model)
+        "full, jsonable_encoder": lambda: json.dumps(jsonable_encoder(repos)).encode(),
+        "full, orjson": lambda: dumps_listing(repos),
+        f"fields={FIELDS}": lambda: dumps_listing(repos, include),
+    }
+
+    print(f"{n} repositories, best of 3 x {number} runs")
+    for name, case in cases.items():
+        size = len(case())
+        seconds = min(timeit.repeat(case, number=number, repeat=3)) / number
+        print(f"{name:45} {size / 1024:8.1f} KiB {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""FastAPI's response_model path vs ModelResponse, for one repository and the list.
+
+    python -m benchmarks.bench_serialization
+"""
+
+import asyncio
+import timeit
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from devops_console_rest_api.cache import Listing, content_etag
+from devops_console_rest_api.models.bitbucket import Repository
+from devops_console_rest_api.serialization import ModelResponse, dumps, dumps_listing
+
+from .catalog import make_catalog
+
+
+def response_model_path(loop, field, content) -> bytes:
+    """What FastAPI does with a `response_model`: validate, encode, then json.dumps."""
+    serialized = loop.run_until_complete(
+        serialize_response(field=field, response_content=content)
+    )
+    return JSONResponse(serialized).body
+
+
+def main(n: int = 1000, number: int = 10):
+    repos = make_catalog(n)
+    repo = repos[0]
+    listing = Listing(values=repos, version=1, fetched_at=0, etag=content_etag(repos))
+
+    repo_field = create_response_field(name="Response_repo", type_=Repository)
+    list_field = create_response_field(name="Response_repos", type_=List[Repository])
+
+    loop = asyncio.new_event_loop()
+
+    cases = {
+        "single, response_model": lambda: response_model_path(loop, repo_field, repo),
+        "single, ModelResponse": lambda: ModelResponse(dumps(repo)).body,
+        "list, response_model": lambda: response_model_path(loop, list_field, repos),
+        "list, ModelResponse": lambda: ModelResponse(dumps_listing(repos)).body,
+        "list, ModelResponse (cached per version)": lambda: ModelResponse(
+            listing.derive("json", lambda _: dumps_listing(repos))
+        ).body,
+    }
+
+    print(f"{n} repositories, best of 3 x {number} runs")
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=number, repeat=3)) / number
+        print(f"{name:45} {seconds * 1000:10.3f} ms")
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""CPU time per webhook event: full model validation vs the routing fields only.
+
+    python -m benchmarks.bench_webhook_parsing
+"""
+
+import json
+import timeit
+
+from devops_console_rest_api.models.webhooks import RepoPushEvent, WebhookEventKey
+from devops_console_rest_api.webhooks_server.events import Event
+
+from tests.fixtures import mock_commitshort, mock_pushchange, mock_repopushevent
+
+LINKS = {
+    name: {"href": f"https://bitbucket.org/test/test/{name}"}
+    for name in ("self", "html", "diff", "commits")
+}
+
+
+def merge_train(changes: int = 5) -> dict:
+    """A push of several branches with 5 commits each (the most Bitbucket sends)."""
+    change = {
+        **mock_pushchange,
+        "links": LINKS,
+        "commits": [{**mock_commitshort, "links": LINKS}] * 5,
+    }
+    return {
+        **mock_repopushevent,
+        "push": {
+            "changes": [
+                {**change, "new": {**change["new"], "name": f"branch-{i}"}}
+                for i in range(changes)
+            ]
+        },
+    }
+
+
+def before(body: bytes):
+    """What handle_webhook_event did: request.json(), then the model."""
+    return RepoPushEvent(**json.loads(body)).push["changes"][0].new.name
+
+
+def routing(body: bytes):
+    event = Event.parse(WebhookEventKey.repo_push, body)
+    return event.repository_uuid, event.branches
+
+
+def routing_then_model(body: bytes):
+    event = Event.parse(WebhookEventKey.repo_push, body)
+    return event.branches, event.model
+
+
+def main(number: int = 2000):
+    payloads = {
+        "repo:push (fixture)": mock_repopushevent,
+        "repo:push (5 branches)": merge_train(),
+    }
+    cases = {
+        "json.loads + model": before,
+        "orjson + routing fields": routing,
+        "orjson + routing fields + model": routing_then_model,
+    }
+
+    print(f"best of 3 x {number} events")
+    for payload_name, payload in payloads.items():
+        body = json.dumps(payload).encode()
+        print(f"{payload_name}, {len(body)} bytes")
+        baseline = None
+        for name, case in cases.items():
+            seconds = min(timeit.repeat(lambda: case(body), number=number, repeat=3))
+            seconds /= number
+            baseline = baseline or seconds
+            print(
+                f"  {name:40} {seconds * 1e6:8.1f} us/event"
+                f" {(1 - seconds / baseline) * 100:6.1f}% saved"
+            )
+
+
+if __name__ == "__main__":
+    main()
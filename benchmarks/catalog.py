@@ -0,0 +1,101 @@
+"""Synthetic Bitbucket catalog for the benchmarks."""
+
+from datetime import datetime, timedelta
+import random
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from devops_console_rest_api.models.bitbucket import Project, Repository
+
+WORKSPACE = "croixbleue"
+API = "https://api.bitbucket.org/2.0"
+SITE = "https://bitbucket.org"
+
+
+def _links(path: str) -> Dict[str, Dict[str, str]]:
+    return {
+        "self": {"href": f"{API}/{path}"},
+        "html": {"href": f"{SITE}/{path}"},
+        "avatar": {"href": f"{SITE}/{path}/avatar/32"},
+    }
+
+
+def make_project(i: int) -> Dict[str, Any]:
+    key = f"PRJ{i}"
+    return {
+        "type": "project",
+        "links": _links(f"workspaces/{WORKSPACE}/projects/{key}"),
+        "uuid": str(uuid4()),
+        "key": key,
+        "name": f"Project {i}",
+        "description": f"Applications of team {i}",
+        "is_private": True,
+        "created_on": str(datetime(2020, 1, 1) + timedelta(days=i)),
+        "updated_on": str(datetime(2022, 1, 1) + timedelta(days=i)),
+    }
+
+
+def make_repository(i: int, project: Dict[str, Any]) -> Dict[str, Any]:
+    slug = f"service-{i:04d}"
+    return {
+        "type": "repository",
+        "links": _links(f"repositories/{WORKSPACE}/{slug}"),
+        "uuid": str(uuid4()),
+        "full_name": f"{WORKSPACE}/{slug}",
+        "is_private": True,
+        "owner": {
+            "type": "team",
+            "links": _links(f"workspaces/{WORKSPACE}"),
+            "username": WORKSPACE,
+            "display_name": "Croix Bleue",
+            "created_on": "2015-01-01T00:00:00",
+            "uuid": str(uuid4()),
+            "has_2fa_enabled": False,
+        },
+        "name": slug,
+        "created_on": str(datetime(2019, 1, 1) + timedelta(hours=i)),
+        "updated_on": str(
+            datetime(2022, 1, 1) + timedelta(minutes=random.randint(0, 10**6))
+        ),
+        "size": random.randint(10**5, 10**8),
+        "language": random.choice(["python", "java", "typescript", "go"]),
+        "has_issues": False,
+        "has_wiki": False,
+        "fork_policy": "no_public_forks",
+        "project": project,
+        "mainbranch": {
+            "type": "branch",
+            "name": "master",
+            "links": _links(f"repositories/{WORKSPACE}/{slug}/refs/branches/master"),
+            "target": {
+                "type": "commit",
+                "hash": f"{random.getrandbits(160):040x}",
+                "date": "2022-06-01T12:00:00",
+                "author": {
+                    "raw": "Dev <dev@example.com>",
+                    "user": {
+                        "username": "dev",
+                        "created_on": "2018-01-01T00:00:00",
+                        "uuid": str(uuid4()),
+                        "has_2fa_enabled": True,
+                    },
+                },
+                "message": "Merge branch 'feature'",
+                "summary": {"type": "rendered"},
+            },
+        },
+    }
+
+
+def make_catalog(n: int = 1000, projects: int = 40) -> List[Repository]:
+    """`n` validated repositories spread over `projects` projects."""
+    random.seed(n)
+    project_payloads = [make_project(i) for i in range(projects)]
+    return [
+        Repository.parse_obj(make_repository(i, project_payloads[i % projects]))
+        for i in range(n)
+    ]
+
+
+def make_projects(n: int = 40) -> List[Project]:
+    return [Project.parse_obj(make_project(i)) for i in range(n)]
@@ -1,86 +1,403 @@
-import asyncio
+import hashlib
+from http import HTTPStatus
 import logging
+from typing import Any, Dict, List, Type
 
 from aiobitbucket.errors import NetworkError
-from fastapi import APIRouter, HTTPException
-from pydantic import UUID4
-
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import UUID4, BaseModel
+
+from .... import default_webhooks, provisioning
+from ....cache import (
+    Listing,
+    projects_cache,
+    repositories_cache,
+    repository_cache,
+    uuid_key,
+)
 from ....client import bitbucket_client as client
-from ....config import (
-    WEBHOOKS_DEFAULT_DESCRIPTION,
-    WEBHOOKS_DEFAULT_EVENTS,
-    WEBHOOKS_URL,
+from ....compression import compress, negotiate_encoding, preferred_encoding
+from ....config import PROVISIONING_WAIT
+from ....index import RepositoryIndex, RepositorySort
+from ....jobs import job_manager
+from ....models.bitbucket import (
+    Paginated,
+    Project,
+    Repository,
+    RepositoryBatch,
+    RepositoryBatchGet,
+    RepositoryBatchPost,
+    RepositoryPost,
+)
+from ....models.jobs import JobSummary
+from ....ratelimit import webhooks_rate_limiter
+from ....search import repository_search
+from ....serialization import (
+    NDJSON_MEDIA_TYPE,
+    Include,
+    ModelResponse,
+    dumps,
+    dumps_listing,
+    ndjson_lines,
+    parse_fields,
 )
-from ....models.bitbucket import Paginated, Project, Repository, RepositoryPost
-from ....models.webhooks import WebhookSubscription
 
 router = APIRouter()
 
+MAX_PAGELEN = 100
+
+FIELDS_QUERY = Query(
+    None,
+    description="Comma-separated fields to return, eg: name,uuid,project.key",
+)
+
+
+def _wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _etag(listing: Listing, request: Request) -> str:
+    """The ETag of a listing response; it varies with the query and the media type.
+
+    It's weak if the response may be compressed: the compressed body is equivalent,
+    not byte-for-byte identical. A 304 then sends the same ETag as a 200 would.
+    """
+    variant = (request.url.query, NDJSON_MEDIA_TYPE if _wants_ndjson(request) else "")
+    etag = listing.etag
+    if any(variant):
+        digest = hashlib.sha1("|".join((listing.etag, *variant)).encode())
+        etag = f'"{digest.hexdigest()}"'
+    if preferred_encoding(request.headers.get("accept-encoding")) is not None:
+        etag = f"W/{etag}"
+    return etag
+
+
+def _not_modified(etag: str, if_none_match: str | None, response: Response):
+    """Set the ETag of a listing response; return a 304 if the client has it already."""
+    response.headers["ETag"] = etag
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+
+    if if_none_match is None:
+        return None
+
+    etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in etags or etag.removeprefix("W/") in etags:
+        return Response(status_code=304, headers=dict(response.headers))
+
+    return None
+
+
+def _page_url(request: Request, page: int, last_page: int) -> str | None:
+    if page < 1 or page > last_page:
+        return None
+    return str(request.url.include_query_params(page=page))
+
+
+def _include(fields: str | None, model: Type[BaseModel]) -> Include | None:
+    if not fields:
+        return None
+    try:
+        return parse_fields(fields, model) or None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _render(
+    request: Request,
+    response: Response,
+    values: List[BaseModel],
+    include: Include | None = None,
+    page: Dict[str, Any] | None = None,
+    listing: Listing | None = None,
+):
+    """Render listing values: as NDJSON, as a list or as a page (if `page` is given).
+
+    Only the fields in `include` (if any) are serialized. When the values are a
+    whole `listing`, its JSON is only serialized (and compressed, if the client
+    accepts it) once per version.
+    """
+    if _wants_ndjson(request):
+        return StreamingResponse(
+            ndjson_lines(values, include),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=dict(response.headers),
+        )
+
+    if listing is None or include is not None:
+        return ModelResponse(
+            dumps_listing(values, include, page), headers=dict(response.headers)
+        )
+
+    body = listing.derive("json", lambda _: dumps_listing(values, page=page))
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), len(body))
+    if encoding is not None:
+        body = listing.derive(f"json.{encoding}", lambda _: compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+
+    return ModelResponse(body, headers=dict(response.headers))
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Repositories
 # ----------------------------------------------------------------------------------------------------------------------
 
 
 @router.get("/repos")
-async def get_repositories():
+async def get_repositories(
+    request: Request,
+    response: Response,
+    page: int | None = Query(None, ge=1),
+    pagelen: int | None = Query(None, ge=1, le=MAX_PAGELEN),
+    project: str | None = Query(None, description="Project key"),
+    name_prefix: str | None = None,
+    language: str | None = None,
+    sort: RepositorySort | None = None,
+    fields: str | None = FIELDS_QUERY,
+    if_none_match: str | None = Header(None),
+):
+    """
+    List the repositories.
+
+    Without any query parameter, this is the whole list. Otherwise, it's a page
+    (see `Paginated`) of the repositories matching the filters.
+
+    With `Accept: application/x-ndjson`, the repositories (of the page, if any) are
+    streamed one per line instead.
+
+    With `fields`, only the given fields of each repository are returned.
+    """
+    include = _include(fields, Repository)
+
     try:
-        return await client.get_repositories()
+        listing = await repositories_cache.get()
     except NetworkError as e:
         logging.error(f"Error while getting repositories: {e.details}")
         raise HTTPException(status_code=e.status, detail=e.details)
 
+    not_modified = _not_modified(_etag(listing, request), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+
+    paginated = (page, pagelen, project, name_prefix, language, sort)
+    if all(param is None for param in paginated):
+        return _render(request, response, listing.values, include, listing=listing)
+
+    page = page or 1
+    pagelen = pagelen or 10
+
+    size, values = RepositoryIndex.of(listing).query(
+        page=page,
+        pagelen=pagelen,
+        project=project,
+        name_prefix=name_prefix,
+        language=language,
+        sort=sort or RepositorySort.name,
+    )
+    last_page = max((size + pagelen - 1) // pagelen, 1)
+
+    return _render(
+        request,
+        response,
+        values,
+        include,
+        page={
+            "size": size,
+            "page": page,
+            "pagelen": pagelen,
+            "next": _page_url(request, page + 1, last_page),
+            "previous": _page_url(request, page - 1, last_page),
+        },
+    )
+
+
+@router.get("/repos/search", response_model=Paginated[Repository])
+async def search_repositories(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, description="Words or fragments of words"),
+    limit: int = Query(20, ge=1, le=MAX_PAGELEN),
+    fields: str | None = FIELDS_QUERY,
+):
+    """
+    Search the repositories by name, description and project (key, name and
+    description), best matches first.
+
+    Every word of `q` must match (a fragment of) a word of the repository.
+    """
+    include = _include(fields, Repository)
+
+    try:
+        # the search index follows the cache, which is filled with the listing
+        await repositories_cache.get()
+    except NetworkError as e:
+        logging.error(f"Error while getting repositories: {e.details}")
+        raise HTTPException(status_code=e.status, detail=e.details)
+
+    size, values = repository_search.search(q, limit)
+
+    return _render(
+        request,
+        response,
+        values,
+        include,
+        page={
+            "size": size,
+            "page": 1,
+            "pagelen": limit,
+            "next": None,
+            "previous": None,
+        },
+    )
+
+
+@router.post("/repos:batchGet", response_model=RepositoryBatch)
+async def batch_get_repositories(
+    batch: RepositoryBatchGet, fields: str | None = FIELDS_QUERY
+):
+    """
+    Get several repositories, by uuid and/or by name, in one round-trip.
+
+    Cached repositories are answered right away and the others are fetched
+    concurrently. Each item has either the `repository` or the `error` that
+    prevented getting it.
+    """
+    include = _include(fields, Repository)
+
+    results = await repository_cache.get_many(uuids=batch.uuids, names=batch.names)
+
+    values = []
+    requested = [("uuid", uuid_key(uuid)) for uuid in batch.uuids]
+    requested += [("name", name) for name in batch.names]
+    for field, key in requested:
+        item: Dict[str, Any] = {field: key}
+        result = results[key]
+        if isinstance(result, NetworkError):
+            item["error"] = {"status": result.status, "detail": str(result.details)}
+        elif isinstance(result, Exception):
+            logging.error(f"Failed to get repository {key}: {result}")
+            item["error"] = {"status": 500, "detail": str(result)}
+        else:
+            item["repository"] = result.dict(include=include)
+        values.append(item)
+
+    return ModelResponse({"values": values})
+
+
+@router.post(
+    "/repos:batchCreate",
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=JobSummary,
+)
+async def batch_create_repositories(batch: RepositoryBatchPost):
+    """
+    Create several repositories (and set their webhooks), in a background job.
+
+    The repositories are provisioned concurrently, within the rate limits; the
+    job `result` has the status of each step for each repository.
+
+    Follow its progress with `/jobs/{id}`.
+    """
+    names = [repo.name for repo in batch.repositories]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Duplicate repository names: {', '.join(duplicates)}",
+        )
+
+    params = {"repositories": [repo.dict() for repo in batch.repositories]}
+    return job_manager.start(provisioning.PROVISION, params).summary()
+
+
+@router.get(
+    "/repos/create_default_webhooks",
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=JobSummary,
+)
+async def create_default_webhooks(dry_run: bool = False, refresh: bool = False):
+    """
+    Subscribe each repository to the default webhooks, in a background job.
+
+    Only the calls needed to reach that state are made: a subscription missing
+    events is updated, duplicates and subscriptions to an old URL are deleted.
+
+    With `dry_run`, the planned calls are only listed (in the job `result`). With
+    `refresh`, the subscriptions are listed again rather than taken from the last
+    known state.
+
+    Follow its progress with `/jobs/{id}`.
+    """
+    params = {"dry_run": dry_run, "refresh": refresh}
+    return job_manager.start(default_webhooks.SUBSCRIBE, params).summary()
+
+
+@router.get(
+    "/repos/remove_default_webhooks",
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=JobSummary,
+)
+async def remove_default_webhooks(dry_run: bool = False, refresh: bool = False):
+    """
+    Remove the default webhooks from all repositories, in a background job.
+
+    `dry_run` and `refresh` work as for `create_default_webhooks`.
+
+    Follow its progress with `/jobs/{id}`.
+    """
+    params = {"dry_run": dry_run, "refresh": refresh}
+    return job_manager.start(default_webhooks.UNSUBSCRIBE, params).summary()
+
 
 @router.get("/repos/{uuid}", response_model=Repository)
-async def get_repository_by_uuid(uuid: UUID4):
-    return await client.get_repository(args={"uuid": uuid})
+async def get_repository_by_uuid(uuid: UUID4, fields: str | None = FIELDS_QUERY):
+    include = _include(fields, Repository)
+    repo = await repository_cache.get(uuid=uuid)
+    return ModelResponse(dumps(repo, include))
 
 
 @router.get("/repos/{name}", response_model=Repository)
-async def get_repository_by_name(name: str):
-    return await client.get_repository(repository=name)
+async def get_repository_by_name(name: str, fields: str | None = FIELDS_QUERY):
+    include = _include(fields, Repository)
+    repo = await repository_cache.get(name=name)
+    return ModelResponse(dumps(repo, include))
 
 
 @router.post("/repos")
 async def create_repository(repo: RepositoryPost):
     """
     Create a new repository (if it doesn't exist) and set the webhooks.
-    """
 
-    try:
-        responserepo = asyncio.run_coroutine_threadsafe(
-            client.add_repository(
-                repository=repo.dict(),
-                template="empty-repo-for-applications",
-                template_params={},
-                args=None,
-            ),
-            loop=client.loop,
-        ).result(10)
-    except NetworkError as e:
-        logging.error(f"Failed to create repository: {e.details}")
-        raise HTTPException(status_code=e.status, detail=e.details)
+    Each step is retried on transient errors. If a step still fails, the
+    repository is left as it is: posting it again resumes the provisioning.
 
-    if not responserepo:
+    The steps after creating the repository run in a background job. If they
+    take longer than PROVISIONING_WAIT seconds (eg: held back by the webhooks rate
+    limit), the answer is a 202 with the job; follow its progress with
+    `/jobs/{id}`.
+    """
+    outputs: provisioning.Outputs = {}
+    try:
+        await provisioning.provision(repo, outputs, until="create_repository")
+    except provisioning.StepFailed as e:
+        if isinstance(e.error, NetworkError):
+            raise HTTPException(status_code=e.error.status, detail=e.error.details)
         raise HTTPException(status_code=400, detail="Failed to create repository")
 
-    # Set the default webhook
-    try:
-        asyncio.run_coroutine_threadsafe(
-            client.create_webhook_subscription(
-                repo_name=repo.name,
-                url=WEBHOOKS_URL,
-                active=True,
-                events=WEBHOOKS_DEFAULT_EVENTS,
-                description=WEBHOOKS_DEFAULT_DESCRIPTION,
-                args=None,
-            ),
-            client.loop,
+    params = {"repositories": [repo.dict()], "outputs": {repo.name: outputs}}
+    job = job_manager.start(provisioning.PROVISION, params)
+    if not await job_manager.wait(job, PROVISIONING_WAIT):
+        return ModelResponse(job.summary(), status_code=HTTPStatus.ACCEPTED)
+
+    error = job.errors.get(repo.name, job.error)
+    if error is not None:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_GATEWAY,
+            detail=f"Repository created, but provisioning failed: {error}",
         )
-    except NetworkError as e:
-        logging.error(e)
-        raise HTTPException(status_code=e.status, detail=e.details)
 
-    return responserepo
+    return outputs["create_repository"]
 
 
 @router.put("/repos/{uuid}", response_model=Repository)
@@ -93,142 +410,84 @@ async def delete_repository(uuid: UUID4):
     raise NotImplementedError
 
 
-@router.get("/repos/create_default_webhooks")
-async def create_default_webhooks():
-    """Subscribe to webhooks for each repository (must be idempotent)."""
+# ------------------------------------------------------------------------------
+# Projects
+# ------------------------------------------------------------------------------
+
+
+@router.get("/projects", response_model=Paginated[Project])
+async def get_projects(
+    request: Request,
+    response: Response,
+    fields: str | None = FIELDS_QUERY,
+    if_none_match: str | None = Header(None),
+):
+    """
+    List the projects.
+
+    With `Accept: application/x-ndjson`, the projects are streamed one per line.
+    With `fields`, only the given fields of each project are returned.
+    """
+    include = _include(fields, Project)
 
-    # get list of repositories
     try:
-        repos = await client.get_repositories()
+        listing = await projects_cache.get()
     except NetworkError as e:
-        logging.warn(f"Failed to get list of repositories: {e}")
+        logging.error(f"Failed to get list of projects: {e.details}")
         raise HTTPException(status_code=e.status, detail=e.details)
 
-    subscriptions = []
-
-    # we'll batch the requests since there are a lot of them, but note that the
-    # rate limit for webhooks is 1000 reqs/hour, so just keep that in mind if
-    # testing this out (there are roughly 400 repos at the time of writing)
-    coros = []
-
-    for repo in repos:
-
-        async def _subscribe_if_not_set(repo):
-            # get list of webhooks for this repo
-            try:
-                current_subscriptions = await client.get_webhook_subscriptions(
-                    repo_name=repo.name
-                )
-            except NetworkError as e:
-                logging.warn(
-                    f"Failed to get webhook subscriptions for {repo.name}: {e.details}"
-                )
-                return
-
-            # check if the webhook is already set
-            if any(
-                [
-                    subscription["url"] == WEBHOOKS_URL
-                    and all(
-                        [
-                            event in subscription["events"]
-                            for event in WEBHOOKS_DEFAULT_EVENTS
-                        ]
-                    )
-                    for subscription in current_subscriptions["values"]
-                ]
-            ):
-                logging.warn(f"Webhook subscription already exists for {repo.name}.")
-                return
-
-            # create the webhook
-            try:
-                new_subscription = await client.create_webhook_subscription(
-                    repo_name=repo.name,
-                    url=WEBHOOKS_URL,
-                    active=True,
-                    events=WEBHOOKS_DEFAULT_EVENTS,
-                    description=WEBHOOKS_DEFAULT_DESCRIPTION,
-                )
-                logging.warn(f"Subscribed to default webhook for {repo.name}.")
-            except NetworkError as e:
-                logging.warn(
-                    f"Failed to create webhook subscription for {repo.name}: {e.details}"
-                )
-                return
-
-            subscriptions.append(WebhookSubscription(**new_subscription))
-
-        coros.append(_subscribe_if_not_set(repo))
-
-    await asyncio.gather(*coros)
-
-    return subscriptions
-
-
-@router.get("/repos/remove_default_webhooks")
-async def remove_default_webhooks():
-    """Remove the default webhooks from all repositories."""
-
-    # get list of repositories
-    try:
-        repos = await client.get_repositories()
-    except NetworkError as e:
-        logging.warn(f"Failed to get list of repositories: {e.details}")
-        return
-
-    coros = []
-
-    for repo in repos:
-
-        async def _remove_default_webhooks(repo):
-            try:
-                current_subscriptions = await client.get_webhook_subscriptions(
-                    repo_name=repo.name
-                )
-            except NetworkError as e:
-                logging.warn(
-                    f"Failed to get webhook subscriptions for {repo.name}: {e.details}"
-                )
-                return
-
-            if (
-                current_subscriptions is None
-                or len(current_subscriptions["values"]) == 0
-            ):
-                logging.warn(f"No webhook subscriptions for {repo.name}.")
-                return
-
-            for subscription in current_subscriptions["values"]:
-                if subscription["url"] == WEBHOOKS_URL:
-                    try:
-                        await client.delete_webhook_subscription(
-                            repo_name=repo.name,
-                            subscription_id=subscription["uuid"],
-                        )
-                        logging.warn(f"Deleted webhook subscription for {repo.name}.")
-                    except NetworkError as e:
-                        logging.warn(
-                            f"Failed to delete webhook subscription for {repo.name}: {e.details}"
-                        )
-                        continue
-
-            logging.info(f"Removed default webhooks from {repo.name}.")
-
-        coros.append(_remove_default_webhooks(repo))
-
-    await asyncio.gather(*coros)
+    not_modified = _not_modified(_etag(listing, request), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+
+    projects = listing.values
+    return _render(
+        request,
+        response,
+        projects,
+        include,
+        page={
+            "size": len(projects),
+            "page": 1,
+            "pagelen": len(projects),
+            "next": None,
+            "previous": None,
+        },
+        listing=listing,
+    )
 
 
 # ------------------------------------------------------------------------------
-# Projects
+# Jobs
 # ------------------------------------------------------------------------------
 
 
-@router.get("/projects", response_model=Paginated[Project])
-async def get_projects():
-    try:
-        return await client.get_projects()
-    except NetworkError as e:
-        logging.error(f"Failed to get list of projects: {e.details}")
-        raise HTTPException(status_code=e.status, detail=e.details)
+@router.get("/jobs", response_model=List[JobSummary])
+async def get_jobs():
+    return [job.summary() for job in job_manager.list()]
+
+
+@router.get("/jobs/{id}", response_model=JobSummary)
+async def get_job(id: str):
+    job = job_manager.get(id)
+    if job is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Job not found")
+    return job.summary()
+
+
+# ------------------------------------------------------------------------------
+# Stats
+# ------------------------------------------------------------------------------
+
+
+@router.get("/stats")
+async def get_stats():
+    """Runtime counters of the Bitbucket client and caches."""
+    return {
+        "client": client.stats(),
+        "rate_limits": {"webhooks": webhooks_rate_limiter.stats()},
+        "cache": {
+            "repositories": repositories_cache.stats(),
+            "projects": projects_cache.stats(),
+        },
+    }
@@ -0,0 +1,366 @@
+import asyncio
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Tuple,
+    Type,
+    TypeVar,
+)
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from .client import BATCH_CONCURRENCY, bitbucket_client as client
+from .config import CATALOG_MAX_STALENESS, CATALOG_TTL
+from .models.bitbucket import Project, Repository
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def to_model(model: Type[M], obj: Any) -> M:
+    """Build a `model` from what the core sccs returned (model, dict or object)."""
+    if isinstance(obj, model):
+        return obj
+    if isinstance(obj, BaseModel):
+        obj = obj.dict()
+    elif not isinstance(obj, dict):
+        obj = vars(obj)
+    return model.parse_obj(obj)
+
+
+def values_of(result: Any) -> List[Any]:
+    """The items of a listing, whether it's paginated or not."""
+    if isinstance(result, dict):
+        return list(result.get("values", []))
+    if hasattr(result, "values") and not callable(result.values):
+        return list(result.values)
+    return list(result)
+
+
+def uuid_key(uuid: UUID | str) -> str:
+    """Normalize a uuid (bitbucket wraps them in braces) to use it as a key."""
+    return str(UUID(str(uuid).strip("{}")))
+
+
+class RepositoryCache:
+    """Repositories by uuid, also reachable by name and full_name.
+
+    Entries are replaced one at a time (see refresh) rather than dropped all at once,
+    so a change to one repository doesn't send every reader back to Bitbucket.
+    """
+
+    def __init__(self):
+        # called with (uuid key, repository) when a repository is added or replaced,
+        # and with (uuid key, None) when it's dropped
+        self.listeners: List[Callable[[str, Repository | None], None]] = []
+
+        self._by_uuid: Dict[str, Repository] = {}
+        self._uuid_by_name: Dict[str, str] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_uuid)
+
+    def items(self) -> List[Tuple[str, Repository]]:
+        return list(self._by_uuid.items())
+
+    def lookup(
+        self, uuid: UUID | str | None = None, name: str | None = None
+    ) -> Repository | None:
+        """Return the cached repository, if any."""
+        key = uuid_key(uuid) if uuid is not None else self._uuid_by_name.get(name)
+        return self._by_uuid.get(key)
+
+    async def get(
+        self, uuid: UUID | str | None = None, name: str | None = None
+    ) -> Repository:
+        """Return the repository from the cache, fetching it on a miss."""
+        repo = self.lookup(uuid=uuid, name=name)
+        if repo is not None:
+            return repo
+
+        if uuid is not None:
+            result = await client.get_repository(args={"uuid": uuid})
+        else:
+            result = await client.get_repository(repository=name)
+
+        return self.put(result)
+
+    async def get_many(
+        self,
+        uuids: Iterable[UUID | str] = (),
+        names: Iterable[str] = (),
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> Dict[str, Repository | Exception]:
+        """Return several repositories, by uuid (normalized, see uuid_key) and name.
+
+        Cached repositories are returned as is; the others are fetched in a single
+        batch, at most `concurrency` at a time. A repository that can't be fetched
+        is returned as the exception raised while fetching it.
+        """
+        results: Dict[str, Repository | Exception] = {}
+        calls: List[Dict[str, Any]] = []
+
+        for key in dict.fromkeys(uuid_key(uuid) for uuid in uuids):
+            repo = self.lookup(uuid=key)
+            if repo is not None:
+                results[key] = repo
+            else:
+                calls.append({"args": {"uuid": key}})
+
+        for name in dict.fromkeys(names):
+            repo = self.lookup(name=name)
+            if repo is not None:
+                results[name] = repo
+            else:
+                calls.append({"repository": name})
+
+        async for kwargs, outcome in client.map("get_repository", calls, concurrency):
+            key = (
+                kwargs["repository"]
+                if "repository" in kwargs
+                else kwargs["args"]["uuid"]
+            )
+            if isinstance(outcome, Exception):
+                results[key] = outcome
+                continue
+            try:
+                results[key] = self.put(outcome)
+            except Exception as e:
+                results[key] = e
+
+        return results
+
+    def put(self, repo: Any) -> Repository:
+        """Add or replace a repository."""
+        repo = to_model(Repository, repo)
+        key = uuid_key(repo.uuid)
+
+        previous = self._by_uuid.get(key)
+        if previous is not None:
+            self._forget_names(previous)
+
+        self._by_uuid[key] = repo
+        self._uuid_by_name[repo.name] = key
+        self._uuid_by_name[repo.full_name] = key
+        self._notify(key, repo)
+        return repo
+
+    def invalidate(self, uuid: UUID | str) -> None:
+        """Drop a repository; the next reader will fetch it again."""
+        key = uuid_key(uuid)
+        repo = self._by_uuid.pop(key, None)
+        if repo is not None:
+            self._forget_names(repo)
+            self._notify(key, None)
+
+    def sync(self, repos: List[Repository]) -> None:
+        """Make the cache hold exactly `repos` (eg: a new listing of every one)."""
+        keys = {uuid_key(self.put(repo).uuid) for repo in repos}
+        for key in self._by_uuid.keys() - keys:
+            self.invalidate(key)
+
+    def refresh(self, uuid: UUID | str) -> asyncio.Task | None:
+        """Fetch a cached repository again in the background.
+
+        Readers keep getting the current entry until the new one replaces it (if it
+        can be fetched). Does nothing if the repository isn't cached (the next reader
+        will fetch it).
+        """
+        key = uuid_key(uuid)
+        repo = self._by_uuid.get(key)
+        if repo is None:
+            return None
+
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(repo.name))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return task
+
+    async def _refresh(self, name: str) -> None:
+        try:
+            # the core sccs would return what it cached before the change
+            self.put(await client.call_uncached("get_repository", repository=name))
+        except Exception as e:
+            # keep serving the current entry: dropping it would also drop it from
+            # what follows the cache (eg: the search index) until the listing
+            # changes; a deleted repository goes away with the next listing
+            logging.warning(f"Failed to refresh repository {name}: {e}")
+
+    def _notify(self, key: str, repo: Repository | None) -> None:
+        for listener in self.listeners:
+            listener(key, repo)
+
+    def _forget_names(self, repo: Repository) -> None:
+        for name in (repo.name, repo.full_name):
+            if self._uuid_by_name.get(name) == uuid_key(repo.uuid):
+                del self._uuid_by_name[name]
+
+
+@dataclass
+class Listing(Generic[M]):
+    """A version of a cached listing."""
+
+    values: List[M]
+    version: int
+    fetched_at: float  # time.monotonic()
+    etag: str  # hash of the content, computed once per version
+    # data computed from this version (indexes, serialized bodies, ...)
+    derived: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    def derive(self, name: str, build: Callable[["Listing[M]"], Any]) -> Any:
+        """Return `build(self)`, computed only once for this version."""
+        if name not in self.derived:
+            self.derived[name] = build(self)
+        return self.derived[name]
+
+
+def content_etag(values: List[BaseModel]) -> str:
+    """A strong ETag for the given models."""
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update(value.json().encode())
+        digest.update(b"\n")
+    return f'"{digest.hexdigest()}"'
+
+
+class ListingCache(Generic[M]):
+    """A whole listing (eg: every repository) cached with stale-while-revalidate.
+
+    Up to `ttl` seconds old, the listing is served as is. Up to `max_staleness`
+    seconds old, it's still served right away but a (single) refresh is started in
+    the background. Past that, or when nothing is cached yet, readers wait for the
+    refresh.
+    """
+
+    def __init__(
+        self,
+        model: Type[M],
+        fetch: Callable[[], Awaitable[Any]],
+        ttl: float = CATALOG_TTL,
+        max_staleness: float = CATALOG_MAX_STALENESS,
+    ):
+        self.model = model
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_staleness = max(ttl, max_staleness)
+        # called with each new listing
+        self.listeners: List[Callable[[Listing[M]], None]] = []
+
+        self._listing: Listing[M] | None = None
+        self._refreshing: asyncio.Task | None = None
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+        }
+
+    @property
+    def listing(self) -> Listing[M] | None:
+        """The cached listing, if any (whatever its age)."""
+        return self._listing
+
+    def age(self) -> float | None:
+        """Seconds since the cached listing was fetched."""
+        if self._listing is None:
+            return None
+        return time.monotonic() - self._listing.fetched_at
+
+    async def get(self) -> Listing[M]:
+        listing = self._listing
+        if listing is not None:
+            age = self.age()
+            if age < self.ttl:
+                self._stats["hits"] += 1
+                return listing
+            if age < self.max_staleness:
+                self._stats["stale_hits"] += 1
+                self.refresh()
+                return listing
+
+        self._stats["misses"] += 1
+        # shielded: a reader giving up must not cancel the refresh for the others
+        return await asyncio.shield(self.refresh())
+
+    def refresh(self) -> asyncio.Task:
+        """Start fetching the listing again, unless it's already being fetched."""
+        task = self._refreshing
+        if task is None:
+            task = asyncio.create_task(self._refresh())
+            task.add_done_callback(self._refreshed)
+            self._refreshing = task
+        return task
+
+    def set(self, values: List[Any], fetched_at: float | None = None) -> Listing[M]:
+        """Replace the cached listing.
+
+        A new version is only made when the content changed; otherwise the current
+        listing is kept (and considered fresh again).
+        """
+        values = [to_model(self.model, value) for value in values]
+        etag = content_etag(values)
+        fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+        previous = self._listing
+        if previous is not None and previous.etag == etag:
+            previous.fetched_at = fetched_at
+            return previous
+
+        self._listing = Listing(
+            values=values,
+            version=previous.version + 1 if previous is not None else 1,
+            fetched_at=fetched_at,
+            etag=etag,
+        )
+        for listener in self.listeners:
+            listener(self._listing)
+        return self._listing
+
+    async def _refresh(self) -> Listing[M]:
+        self._stats["refreshes"] += 1
+        return self.set(values_of(await self.fetch()))
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        if self._refreshing is task:
+            self._refreshing = None
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["refresh_failures"] += 1
+            logging.warning(
+                f"Failed to refresh {self.model.__name__} listing: {task.exception()}"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "age": self.age(),
+            "version": self._listing.version if self._listing is not None else None,
+            "size": len(self._listing.values) if self._listing is not None else 0,
+        }
+
+
+repository_cache = RepositoryCache()
+
+repositories_cache: ListingCache[Repository] = ListingCache(
+    Repository, lambda: client.get_repositories()
+)
+projects_cache: ListingCache[Project] = ListingCache(
+    Project, lambda: client.get_projects()
+)
+
+# every listing refresh also refreshes the repositories cached by uuid
+repositories_cache.listeners.append(
+    lambda listing: repository_cache.sync(listing.values)
+)
@@ -1,13 +1,340 @@
 from asyncio import AbstractEventLoop
 import asyncio
+from collections import defaultdict
+import functools
 import inspect
-from typing import Any, Dict
+import logging
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from .metrics import MethodMetrics
+from .ratelimit import RateLimiter
 
 # from devops_sccs.plugins.bitbucketcloud import BitbucketCloud
 
+# default timeout (in seconds) for a call bridged to the core event loop
+BRIDGE_TIMEOUT = 60
+
+# methods that need a different timeout (in seconds) than BRIDGE_TIMEOUT
+METHOD_TIMEOUTS = {
+    "add_repository": 10,
+}
+
+# concurrent calls to these (read-only) methods with the same arguments share a
+# single upstream call
+COALESCED_PREFIXES = ("get_",)
+
+# default number of calls of a batch (see Client.map) running at the same time
+BATCH_CONCURRENCY = 10
+
+
+async def _call(f: Callable, *args, **kwargs) -> Any:
+    """Call `f`, awaiting the result if needed."""
+    result = f(*args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def _timed_call(
+    metrics: MethodMetrics, submitted: float, f: Callable, *args, **kwargs
+) -> Any:
+    """Call `f`, recording how long it was queued (since `submitted`) and ran."""
+    started = time.perf_counter()
+    metrics.queued.observe(started - submitted)
+    try:
+        return await _call(f, *args, **kwargs)
+    finally:
+        metrics.execution.observe(time.perf_counter() - started)
+
+
+async def _bridged_call(
+    loop: AbstractEventLoop,
+    metrics: MethodMetrics,
+    timeout: float,
+    f: Callable,
+    *args,
+    **kwargs,
+) -> Any:
+    """Call `f` on the core `loop` and await the result from the calling loop."""
+    g = _timed_call(metrics, time.perf_counter(), f, *args, **kwargs)
+
+    # wrap the concurrent future so that it can be awaited from the calling
+    # loop; cancelling the wrapper (or timing out) cancels the task running
+    # on the core loop as well
+    future = asyncio.run_coroutine_threadsafe(g, loop)
+    metrics.submitted()
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        metrics.timed_out()
+        raise
+    finally:
+        metrics.finished()
+
+
+def _uncached(f: Callable) -> Callable:
+    """`f` without the cache of the core sccs (see atscached), if it has one."""
+    wrapped = getattr(f, "__wrapped__", None)
+    if wrapped is None:
+        return f
+    if inspect.ismethod(f):
+        # the cache decorates the function of the method
+        return functools.partial(wrapped, f.__self__)
+    return wrapped
+
+
+async def _run_batch(
+    f: Callable,
+    calls: List[Dict[str, Any]],
+    concurrency: int,
+    emit: Callable[[Tuple[Dict[str, Any], Any]], None],
+    metrics: MethodMetrics,
+    submitted: float,
+    timeout: float,
+    limiter: RateLimiter | None = None,
+) -> None:
+    """Run `f(**kwargs)` for each kwargs of `calls`, `concurrency` at a time.
+
+    Each (kwargs, result or exception) pair is passed to `emit` as soon as it's done.
+    With a `limiter`, the calls are also kept within its budget (and retried when
+    rate limited); the timeout applies to each attempt.
+
+    Each call is recorded once: queued since `submitted` (the hop to the core loop),
+    then waiting for its turn, then executing (all its attempts).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(kwargs: Dict[str, Any]):
+        ready = time.perf_counter()
+        metrics.queued.observe(ready - submitted)
+        attempts = 0
+        running = 0.0
+
+        async def attempt():
+            nonlocal attempts, running
+            attempts += 1
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(_call(f, **kwargs), timeout)
+            finally:
+                running += time.perf_counter() - started
+
+        try:
+            async with semaphore:
+                try:
+                    if limiter is not None:
+                        outcome = await limiter.call(attempt)
+                    else:
+                        outcome = await attempt()
+                except asyncio.TimeoutError as e:
+                    metrics.timed_out()
+                    outcome = e
+                except Exception as e:
+                    outcome = e
+        finally:
+            metrics.waiting.observe(time.perf_counter() - ready - running)
+            if attempts:
+                metrics.execution.observe(running)
+            metrics.finished()
+        emit((kwargs, outcome))
+
+    await asyncio.gather(*[run_one(kwargs) for kwargs in calls])
+
+
+def _freeze(value: Any) -> Hashable:
+    """Turn call arguments into something usable as a dict key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class _Flight:
+    """An upstream call in progress and the number of callers waiting on it."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
 
 class Client:
-    pass
+    """Bitbucket client; its methods are copied from the core sccs by setup_bb_client."""
+
+    def __init__(self):
+        self.loop: AbstractEventLoop | None = None
+        self._core_methods: Dict[str, Callable] = {}
+        self._core_kwargs: Dict[str, Any] = {}
+        self._metrics: Dict[str, MethodMetrics] = {}
+        self._flights: Dict[Tuple[str, Hashable], _Flight] = {}
+        self._coalesce_stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "upstream": 0, "coalesced": 0}
+        )
+
+    def metrics(self, name: str) -> MethodMetrics:
+        """Metrics of the calls to method `name`."""
+        return self._metrics.setdefault(name, MethodMetrics())
+
+    def coalesced(self, name: str, f: Callable[..., Awaitable]):
+        """Wrap `f` so that identical concurrent calls share one in-flight call."""
+
+        @functools.wraps(f)
+        async def single_flight(*args, **kwargs):
+            key = (name, _freeze((args, kwargs)))
+            stats = self._coalesce_stats[name]
+            stats["calls"] += 1
+
+            flight = self._flights.get(key)
+            if flight is None:
+                stats["upstream"] += 1
+                flight = _Flight(asyncio.ensure_future(f(*args, **kwargs)))
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._flights.pop(key, None))
+            else:
+                stats["coalesced"] += 1
+
+            flight.waiters += 1
+            try:
+                # shield the shared call from the cancellation of a single caller
+                return await asyncio.shield(flight.task)
+            except asyncio.CancelledError:
+                if flight.waiters == 1 and not flight.task.done():
+                    flight.task.cancel()
+                raise
+            finally:
+                flight.waiters -= 1
+
+        return single_flight
+
+    async def call_uncached(self, name: str, **kwargs) -> Any:
+        """Call method `name` past what the core sccs cached for it (see atscached).
+
+        Eg: to get a repository as it is after a push. Only this call skips the
+        cache: what it has for other arguments is still served.
+        """
+        core_method = self._core_methods.get(name)
+        if core_method is None:
+            # not bridged (eg: replaced in tests)
+            return await _call(getattr(self, name), **kwargs)
+
+        return await _bridged_call(
+            self.loop,
+            self.metrics(name),
+            METHOD_TIMEOUTS.get(name, BRIDGE_TIMEOUT),
+            _uncached(core_method),
+            **self._core_kwargs,
+            **kwargs,
+        )
+
+    async def map(
+        self,
+        name: str,
+        calls: Iterable[Dict[str, Any]],
+        concurrency: int = BATCH_CONCURRENCY,
+        limiter: RateLimiter | None = None,
+    ) -> AsyncIterator[Tuple[Dict[str, Any], Any]]:
+        """Call method `name` once for each kwargs of `calls`.
+
+        The whole batch is submitted to the core loop in a single hop and runs there
+        with at most `concurrency` calls at a time (and within the budget of
+        `limiter`, if any). (kwargs, outcome) pairs are yielded as the calls
+        complete; the outcome is either the result or the exception raised by the
+        call. If the batch itself fails (eg: it's cancelled on the core loop), the
+        calls it didn't complete are yielded with the batch's exception.
+        """
+        calls = list(calls)
+        loop = asyncio.get_running_loop()
+        outcomes: asyncio.Queue = asyncio.Queue()
+
+        def emit(item):
+            loop.call_soon_threadsafe(outcomes.put_nowait, item)
+
+        metrics = self.metrics(name)
+        metrics.submitted(len(calls))
+        timeout = METHOD_TIMEOUTS.get(name, BRIDGE_TIMEOUT)
+
+        core_method = self._core_methods.get(name)
+        if core_method is not None:
+            f = functools.partial(core_method, **self._core_kwargs)
+            batch = _run_batch(
+                f,
+                calls,
+                concurrency,
+                emit,
+                metrics,
+                time.perf_counter(),
+                timeout,
+                limiter,
+            )
+            try:
+                future = asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(batch, self.loop)
+                )
+            except BaseException:
+                # the calls are counted out as they finish, which they never will
+                metrics.finished(len(calls))
+                raise
+        else:
+            # not bridged (eg: replaced in tests), run the calls on this loop
+            future = asyncio.ensure_future(
+                _run_batch(
+                    getattr(self, name),
+                    calls,
+                    concurrency,
+                    emit,
+                    metrics,
+                    time.perf_counter(),
+                    timeout,
+                    limiter,
+                )
+            )
+
+        def batch_done(batch: asyncio.Future) -> None:
+            # after the outcomes emitted by the batch, which were queued first
+            if batch.cancelled():
+                outcomes.put_nowait(RuntimeError(f"Batch of {name} calls cancelled"))
+            elif batch.exception() is not None:
+                outcomes.put_nowait(batch.exception())
+
+        future.add_done_callback(batch_done)
+
+        pending = {id(kwargs): kwargs for kwargs in calls}
+        try:
+            for _ in range(len(calls)):
+                item = await outcomes.get()
+                if isinstance(item, BaseException):
+                    for kwargs in pending.values():
+                        yield kwargs, item
+                    return
+                pending.pop(id(item[0]), None)
+                yield item
+        finally:
+            # the consumer may stop early; don't leave calls running on the core loop
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the calls made through this client."""
+        return {
+            "coalescing": {k: dict(v) for k, v in self._coalesce_stats.items()},
+            "bridge": {k: v.snapshot() for k, v in self._metrics.items()},
+        }
 
 
 bitbucket_client = Client()
@@ -17,6 +344,10 @@ bitbucket_client = Client()
 def setup_bb_client(config: Dict[str, Any], core_sccs, loop: AbstractEventLoop) -> None:
     """
     Recreate the Bitbucket client with curried methods run in the parent thread.
+
+    Each method is bridged to the core event loop: calling it returns an awaitable
+    bound to the caller's loop, so the API loop keeps serving other requests while
+    the core loop does the upstream call.
     """
 
     vault_bitbucket: Dict[str, Any] = config.get("vault_bitbucket", {})
@@ -34,13 +365,22 @@ def setup_bb_client(config: Dict[str, Any], core_sccs, loop: AbstractEventLoop)
 
     global bitbucket_client
 
-    def threadsafe_async_partial(f, loop):
-        def async_partial(*args, **kwargs):
-            async def g():
-                return f(*args, plugin_id=plugin_id, session=admin_session, **kwargs)
+    def threadsafe_async_partial(f, loop, name):
+        metrics = bitbucket_client.metrics(name)
+        timeout = METHOD_TIMEOUTS.get(name, BRIDGE_TIMEOUT)
 
-            future = asyncio.run_coroutine_threadsafe(g(), loop)
-            return future.result(60)
+        @functools.wraps(f)
+        async def async_partial(*args, **kwargs):
+            return await _bridged_call(
+                loop,
+                metrics,
+                timeout,
+                f,
+                *args,
+                plugin_id=plugin_id,
+                session=admin_session,
+                **kwargs,
+            )
 
         return async_partial
 
@@ -48,14 +388,22 @@ def setup_bb_client(config: Dict[str, Any], core_sccs, loop: AbstractEventLoop)
         if name.startswith("_"):
             continue
         if inspect.ismethod(member) or inspect.isfunction(member):
+            if hasattr(Client, name):
+                logging.warning(f"Not bridging core sccs method {name}: name is taken")
+                continue
             f = threadsafe_async_partial(
                 member,
                 loop=loop,
+                name=name,
             )
+            if name.startswith(COALESCED_PREFIXES):
+                f = bitbucket_client.coalesced(name, f)
             setattr(bitbucket_client, name, f)
+            bitbucket_client._core_methods[name] = member
         # copy over properties from the core sccs client
         else:
             setattr(bitbucket_client, name, member)
 
     # let's keep a reference to the event loop so that we can batch api calls later on
-    setattr(bitbucket_client, "loop", loop)
+    bitbucket_client.loop = loop
+    bitbucket_client._core_kwargs = {"plugin_id": plugin_id, "session": admin_session}
@@ -0,0 +1,58 @@
+import gzip
+from typing import Dict, List
+
+from .config import COMPRESSION_MIN_SIZE
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# supported encodings, by order of preference
+ENCODINGS: List[str] = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def negotiate_encoding(accept_encoding: str | None, size: int) -> str | None:
+    """The content encoding to use for a body of `size` bytes, if any.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE aren't worth compressing.
+    """
+    if size < COMPRESSION_MIN_SIZE:
+        return None
+    return preferred_encoding(accept_encoding)
+
+
+def preferred_encoding(accept_encoding: str | None) -> str | None:
+    """The supported content encoding the client prefers, if it accepts any."""
+    if not accept_encoding:
+        return None
+
+    qualities: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+
+    candidates = [
+        coding
+        for coding in ENCODINGS
+        if qualities.get(coding, qualities.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    # highest quality first, then by order of preference (sort is stable)
+    return sorted(candidates, key=lambda coding: -qualities.get(coding, 0.0))[0]
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=6)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
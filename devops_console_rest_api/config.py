@@ -36,3 +36,92 @@ WEBHOOKS_DEFAULT_EVENTS = [
 ]
 
 WEBHOOKS_DEFAULT_DESCRIPTION = "Default webhook created via DevOps Console"
+
+# Repository and project listings are served from cache for CATALOG_TTL seconds,
+# then served stale (while being refreshed in the background) for up to
+# CATALOG_MAX_STALENESS seconds after which readers wait for fresh data
+CATALOG_TTL = float(os.environ.get("CATALOG_TTL", 300))
+CATALOG_MAX_STALENESS = float(os.environ.get("CATALOG_MAX_STALENESS", 3600))
+
+# Where the API keeps its local state (catalog snapshot, ...)
+DATA_DIR = os.environ.get("DATA_DIR", ".devops-console")
+
+# The catalog is written to CATALOG_SNAPSHOT_PATH (set it to "" to disable) and
+# served from there on startup, unless it's older than CATALOG_SNAPSHOT_MAX_AGE
+CATALOG_SNAPSHOT_PATH = os.environ.get(
+    "CATALOG_SNAPSHOT_PATH", os.path.join(DATA_DIR, "catalog.snapshot")
+)
+CATALOG_SNAPSHOT_MAX_AGE = float(os.environ.get("CATALOG_SNAPSHOT_MAX_AGE", 86400))
+
+# Responses smaller than this (in bytes) are not compressed
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+
+# Bitbucket allows WEBHOOKS_RATE_LIMIT calls to the webhooks API per
+# WEBHOOKS_RATE_LIMIT_PERIOD seconds; up to WEBHOOKS_RATE_LIMIT_BURST of them are
+# made right away, the others are spread over the period
+WEBHOOKS_RATE_LIMIT = int(os.environ.get("WEBHOOKS_RATE_LIMIT", 1000))
+WEBHOOKS_RATE_LIMIT_PERIOD = float(os.environ.get("WEBHOOKS_RATE_LIMIT_PERIOD", 3600))
+WEBHOOKS_RATE_LIMIT_BURST = int(os.environ.get("WEBHOOKS_RATE_LIMIT_BURST", 50))
+
+# Background jobs keep their progress in JOBS_DIR (set it to "" to keep them in
+# memory only), so the ones interrupted by a restart are resumed; finished jobs are
+# forgotten after JOBS_RETENTION seconds
+JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(DATA_DIR, "jobs"))
+JOBS_RETENTION = float(os.environ.get("JOBS_RETENTION", 7 * 86400))
+
+# The last known webhook subscriptions of each repository are kept in
+# WEBHOOKS_STATE_PATH (set it to "" to keep them in memory only) and trusted for
+# WEBHOOKS_STATE_TTL seconds, after which they're listed again
+WEBHOOKS_STATE_PATH = os.environ.get(
+    "WEBHOOKS_STATE_PATH", os.path.join(DATA_DIR, "webhooks.state")
+)
+WEBHOOKS_STATE_TTL = float(os.environ.get("WEBHOOKS_STATE_TTL", 86400))
+
+# Number of repositories provisioned at the same time by a batch
+PROVISIONING_CONCURRENCY = int(os.environ.get("PROVISIONING_CONCURRENCY", 5))
+
+# Once a repository is created, POST /repos waits up to PROVISIONING_WAIT seconds for
+# the next steps (eg: held back by the webhooks rate limit) before answering with
+# the job running them
+PROVISIONING_WAIT = float(os.environ.get("PROVISIONING_WAIT", 10))
+
+# Received webhook events wait in a queue of up to WEBHOOKS_QUEUE_SIZE events (they
+# are refused beyond that) to be handled by WEBHOOKS_WORKERS workers
+WEBHOOKS_QUEUE_SIZE = int(os.environ.get("WEBHOOKS_QUEUE_SIZE", 1000))
+WEBHOOKS_WORKERS = int(os.environ.get("WEBHOOKS_WORKERS", 4))
+
+# Received webhook events are written to a journal under WEBHOOKS_JOURNAL_DIR (set
+# it to "" to disable it) before being acknowledged, so those not handled yet are
+# handled after a restart. The journal is made of segments of about
+# WEBHOOKS_JOURNAL_SEGMENT_SIZE bytes, kept WEBHOOKS_JOURNAL_RETENTION seconds (for
+# replays); the events received within WEBHOOKS_JOURNAL_FSYNC_DELAY seconds are
+# synced to disk together
+WEBHOOKS_JOURNAL_DIR = os.environ.get(
+    "WEBHOOKS_JOURNAL_DIR", os.path.join(DATA_DIR, "webhooks-journal")
+)
+WEBHOOKS_JOURNAL_SEGMENT_SIZE = int(
+    os.environ.get("WEBHOOKS_JOURNAL_SEGMENT_SIZE", 16 * 1024 * 1024)
+)
+WEBHOOKS_JOURNAL_RETENTION = float(
+    os.environ.get("WEBHOOKS_JOURNAL_RETENTION", 7 * 86400)
+)
+WEBHOOKS_JOURNAL_FSYNC_DELAY = float(
+    os.environ.get("WEBHOOKS_JOURNAL_FSYNC_DELAY", 0.005)
+)
+
+# Deliveries of webhook events (identified by their X-Hook-UUID and X-Request-UUID
+# headers) received again within WEBHOOKS_DEDUPE_WINDOW seconds are acknowledged
+# without being handled; up to WEBHOOKS_DEDUPE_SIZE deliveries are remembered
+WEBHOOKS_DEDUPE_WINDOW = float(os.environ.get("WEBHOOKS_DEDUPE_WINDOW", 86400))
+WEBHOOKS_DEDUPE_SIZE = int(os.environ.get("WEBHOOKS_DEDUPE_SIZE", 100_000))
+
+# Handlers of webhook events taking longer than WEBHOOKS_HANDLER_TIMEOUT seconds
+# (unless they set their own timeout) are cancelled
+WEBHOOKS_HANDLER_TIMEOUT = float(os.environ.get("WEBHOOKS_HANDLER_TIMEOUT", 30))
+
+# Commit statuses of a commit (and pushes to a branch) received within
+# WEBHOOKS_DEBOUNCE_WINDOW seconds of each other are coalesced: only the newest is
+# handled (0 to handle every event). None is held back more than
+# WEBHOOKS_DEBOUNCE_MAX_WAIT seconds, however long the burst.
+WEBHOOKS_DEBOUNCE_WINDOW = float(os.environ.get("WEBHOOKS_DEBOUNCE_WINDOW", 2))
+WEBHOOKS_DEBOUNCE_MAX_WAIT = float(os.environ.get("WEBHOOKS_DEBOUNCE_MAX_WAIT", 10))
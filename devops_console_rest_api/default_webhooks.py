@@ -0,0 +1,337 @@
+"""Reconcile the webhook subscriptions of every repository with the desired state.
+
+The desired state is either "subscribed" (exactly one active subscription to
+WEBHOOKS_URL with at least WEBHOOKS_DEFAULT_EVENTS) or "unsubscribed" (no
+subscription to WEBHOOKS_URL). Either way, subscriptions we made (identified by
+WEBHOOKS_DEFAULT_DESCRIPTION) for another URL are stale and deleted.
+
+Each run is a job where each repository is an item: once it's done, a resumed
+job doesn't go back to it.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, List, Literal, Tuple
+
+from aiobitbucket.errors import NetworkError
+import orjson
+from pydantic import BaseModel
+
+from .cache import repositories_cache
+from .client import bitbucket_client as client
+from .config import (
+    WEBHOOKS_DEFAULT_DESCRIPTION,
+    WEBHOOKS_DEFAULT_EVENTS,
+    WEBHOOKS_STATE_PATH,
+    WEBHOOKS_STATE_TTL,
+    WEBHOOKS_URL,
+)
+from .jobs import JobManager, job_manager
+from .models.jobs import Job
+from .ratelimit import webhooks_rate_limiter
+
+SUBSCRIBE = "create_default_webhooks"
+UNSUBSCRIBE = "remove_default_webhooks"
+
+# the fields of a subscription that matter here
+SUBSCRIPTION_FIELDS = ("uuid", "url", "events", "active", "description")
+
+Subscription = Dict[str, Any]
+
+
+class Action(BaseModel):
+    """An upstream call needed to reach the desired state"""
+
+    kind: Literal["create", "update", "delete"]
+    repo_name: str
+    subscription_id: str | None = None
+    events: List[str] = []
+
+    @property
+    def method(self) -> str:
+        return f"{self.kind}_webhook_subscription"
+
+    @property
+    def key(self) -> Tuple[str, str, str | None]:
+        return self.kind, self.repo_name, self.subscription_id
+
+    def kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"repo_name": self.repo_name}
+        if self.subscription_id is not None:
+            kwargs["subscription_id"] = self.subscription_id
+        if self.kind != "delete":
+            kwargs.update(
+                url=WEBHOOKS_URL,
+                active=True,
+                events=self.events,
+                description=WEBHOOKS_DEFAULT_DESCRIPTION,
+            )
+        return kwargs
+
+
+def _events(events) -> List[str]:
+    return sorted({str(getattr(event, "value", event)) for event in events})
+
+
+def plan(
+    repo_name: str,
+    subscriptions: List[Subscription],
+    subscribed: bool,
+    can_update: bool = True,
+) -> List[Action]:
+    """The actions turning `subscriptions` into the desired state.
+
+    Without `can_update`, a subscription to update is deleted and created again.
+    """
+    ours = [s for s in subscriptions if s["url"] == WEBHOOKS_URL]
+    stale = [
+        s
+        for s in subscriptions
+        if s["url"] != WEBHOOKS_URL
+        and s.get("description") == WEBHOOKS_DEFAULT_DESCRIPTION
+    ]
+    to_delete = stale + (ours if not subscribed else [])
+    actions: List[Action] = []
+
+    if subscribed:
+        default_events = set(_events(WEBHOOKS_DEFAULT_EVENTS))
+        # keep the subscription needing the fewest changes; the others are duplicates
+        ours.sort(
+            key=lambda s: (
+                not default_events <= set(s["events"]),
+                not s.get("active", True),
+            )
+        )
+        keep, duplicates = (ours[0], ours[1:]) if ours else (None, [])
+        to_delete += duplicates
+
+        if keep is None:
+            actions.append(
+                Action(
+                    kind="create", repo_name=repo_name, events=_events(default_events)
+                )
+            )
+        elif not default_events <= set(keep["events"]) or not keep.get("active", True):
+            events = _events(default_events | set(keep["events"]))
+            if can_update:
+                actions.append(
+                    Action(
+                        kind="update",
+                        repo_name=repo_name,
+                        subscription_id=keep["uuid"],
+                        events=events,
+                    )
+                )
+            else:
+                to_delete.append(keep)
+                actions.append(
+                    Action(kind="create", repo_name=repo_name, events=events)
+                )
+
+    deletes = [
+        Action(kind="delete", repo_name=repo_name, subscription_id=s["uuid"])
+        for s in to_delete
+    ]
+    return deletes + actions
+
+
+class SubscriptionStates:
+    """The last known webhook subscriptions of each repository.
+
+    They're updated with the outcome of each action, so a repository whose
+    subscriptions are known (and fresher than `ttl`) doesn't need to be listed
+    again; an unchanged workspace costs no upstream call at all.
+    """
+
+    def __init__(self, path: str, ttl: float = WEBHOOKS_STATE_TTL):
+        self.path = path
+        self.ttl = ttl
+        # repository name: (time.time() when listed, subscriptions)
+        self._states: Dict[str, Tuple[float, List[Subscription]]] = {}
+        self._loaded = False
+
+    def get(self, repo_name: str) -> List[Subscription] | None:
+        state = self._states.get(repo_name)
+        if state is None or time.time() - state[0] > self.ttl:
+            return None
+        return state[1]
+
+    def put(self, repo_name: str, subscriptions: List[Subscription]) -> None:
+        self._states[repo_name] = (
+            time.time(),
+            [
+                {field: s.get(field) for field in SUBSCRIPTION_FIELDS}
+                for s in subscriptions
+            ],
+        )
+
+    def invalidate(self, repo_name: str) -> None:
+        self._states.pop(repo_name, None)
+
+    def apply(self, action: Action, outcome: Any) -> None:
+        """Update the state of a repository with a successful action."""
+        state = self._states.get(action.repo_name)
+        if state is None:
+            return
+        listed_at, subscriptions = state
+
+        if action.kind in ("update", "delete"):
+            subscriptions = [
+                s for s in subscriptions if s["uuid"] != action.subscription_id
+            ]
+        if action.kind in ("create", "update"):
+            subscription = dict(outcome) if isinstance(outcome, dict) else {}
+            if "uuid" not in subscription:
+                # we don't know what we got: list it again next time
+                self.invalidate(action.repo_name)
+                return
+            subscriptions.append(
+                {field: subscription.get(field) for field in SUBSCRIPTION_FIELDS}
+            )
+
+        self._states[action.repo_name] = (listed_at, subscriptions)
+
+    def load(self) -> None:
+        """Read the states saved by a previous run (once)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                states = orjson.loads(f.read())
+            self._states = {name: tuple(state) for name, state in states.items()}
+        except Exception as e:
+            logging.warning(f"Ignoring invalid webhooks state {self.path}: {e}")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(self._states))
+        os.replace(tmp_path, self.path)
+
+
+subscription_states = SubscriptionStates(WEBHOOKS_STATE_PATH)
+
+
+def _error(outcome: Exception) -> str:
+    if isinstance(outcome, NetworkError):
+        return str(outcome.details)
+    # a timeout, or a call of a batch that failed: only this repository failed
+    return repr(outcome)
+
+
+async def reconcile(job: Job, jobs: JobManager, subscribed: bool) -> None:
+    """Bring the pending repositories of the job to the desired state.
+
+    With the `dry_run` parameter, the plan is computed (and set as the job
+    result) but not executed. With `refresh`, the subscriptions of every
+    repository are listed again rather than taken from the known state.
+    """
+    # a resumed job may have been interrupted before saving the outcome of its
+    # actions, so the known state of its pending repositories can't be trusted
+    refresh = job.params.get("refresh", False) or bool(job.items)
+    if not job.items:
+        repos = (await repositories_cache.get()).values
+        jobs.set_items(job, [repo.name for repo in repos])
+
+    dry_run = job.params.get("dry_run", False)
+    states = subscription_states
+    states.load()
+    pending = job.pending_items()
+
+    current: Dict[str, List[Subscription]] = {}
+    to_list: List[str] = []
+    for repo_name in pending:
+        known = None if refresh else states.get(repo_name)
+        if known is not None:
+            current[repo_name] = known
+        else:
+            to_list.append(repo_name)
+
+    async for kwargs, subscriptions in client.map(
+        "get_webhook_subscriptions",
+        [{"repo_name": repo_name} for repo_name in to_list],
+        limiter=webhooks_rate_limiter,
+    ):
+        repo_name = kwargs["repo_name"]
+        if isinstance(subscriptions, Exception):
+            error = _error(subscriptions)
+            logging.warning(
+                f"Failed to get webhook subscriptions for {repo_name}: {error}"
+            )
+            jobs.mark(job, repo_name, error=error)
+            continue
+        current[repo_name] = list((subscriptions or {}).get("values", []))
+        states.put(repo_name, current[repo_name])
+
+    can_update = hasattr(client, "update_webhook_subscription")
+    actions: Dict[Tuple, Action] = {}
+    remaining: Dict[str, int] = {}
+    for repo_name in pending:
+        if repo_name not in current:
+            continue  # failed to list
+        repo_actions = plan(repo_name, current[repo_name], subscribed, can_update)
+        if not repo_actions or dry_run:
+            jobs.mark(job, repo_name)
+        else:
+            remaining[repo_name] = len(repo_actions)
+        actions.update((action.key, action) for action in repo_actions)
+
+    job.result = {"actions": [action.dict() for action in actions.values()]}
+    if dry_run:
+        states.save()
+        return
+
+    # deletions first, so a repository never ends up with two subscriptions
+    for kind in ("delete", "update", "create"):
+        # skip the repositories where a previous action failed
+        batch = [
+            action
+            for action in actions.values()
+            if action.kind == kind and action.repo_name not in job.errors
+        ]
+        if not batch:
+            continue
+
+        async for kwargs, outcome in client.map(
+            batch[0].method,
+            [action.kwargs() for action in batch],
+            limiter=webhooks_rate_limiter,
+        ):
+            repo_name = kwargs["repo_name"]
+            action = actions[(kind, repo_name, kwargs.get("subscription_id"))]
+
+            if isinstance(outcome, Exception):
+                error = _error(outcome)
+                logging.warning(
+                    f"Failed to {kind} webhook subscription for {repo_name}: {error}"
+                )
+                states.invalidate(repo_name)
+                jobs.mark(job, repo_name, error=error)
+                continue
+
+            logging.info(f"Webhook subscription {kind}d for {repo_name}.")
+            states.apply(action, outcome)
+            remaining[repo_name] -= 1
+            if remaining[repo_name] == 0 and repo_name not in job.errors:
+                jobs.mark(job, repo_name)
+
+    states.save()
+
+
+@job_manager.register(SUBSCRIBE)
+async def subscribe(job: Job, jobs: JobManager) -> None:
+    """Subscribe to webhooks for each repository (must be idempotent)."""
+    await reconcile(job, jobs, subscribed=True)
+
+
+@job_manager.register(UNSUBSCRIBE)
+async def unsubscribe(job: Job, jobs: JobManager) -> None:
+    """Remove the default webhooks from all repositories."""
+    await reconcile(job, jobs, subscribed=False)
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+from enum import Enum
+from typing import Callable, Dict, List, Tuple
+
+from .cache import Listing
+from .models.bitbucket import Repository
+
+
+class RepositorySort(str, Enum):
+    name = "name"
+    name_desc = "-name"
+    updated_on = "updated_on"
+    updated_on_desc = "-updated_on"
+
+    @property
+    def field(self) -> str:
+        return self.value.removeprefix("-")
+
+    @property
+    def descending(self) -> bool:
+        return self.value.startswith("-")
+
+
+SORT_KEYS: Dict[str, Callable[[Repository], object]] = {
+    "name": lambda repo: repo.name.lower(),
+    "updated_on": lambda repo: repo.updated_on,
+}
+
+
+class RepositoryIndex:
+    """Indexes over a repository listing, to page through it without scanning it.
+
+    Repositories are kept sorted by every sort key, and grouped by project key and by
+    language (each group also sorted by every sort key). A query starts from the
+    narrowest of these sequences, so a page is usually found in O(page size).
+    """
+
+    def __init__(self, repos: List[Repository]):
+        self.repos = repos
+
+        # positions of the repositories, by sort key
+        self.orders: Dict[str, List[int]] = {
+            name: sorted(range(len(repos)), key=lambda i: key(repos[i]))
+            for name, key in SORT_KEYS.items()
+        }
+        self.lowercase_names = [repos[i].name.lower() for i in self.orders["name"]]
+
+        self.by_project = self._group(lambda repo: repo.project.key)
+        self.by_language = self._group(lambda repo: repo.language.lower())
+
+    @classmethod
+    def of(cls, listing: Listing[Repository]) -> "RepositoryIndex":
+        """The index of a listing, built once per listing version."""
+        return listing.derive("index", lambda listing: cls(listing.values))
+
+    def _group(
+        self, key: Callable[[Repository], str]
+    ) -> Dict[str, Dict[str, List[int]]]:
+        """{group: {sort key: positions}}"""
+        groups: Dict[str, Dict[str, List[int]]] = {}
+        for sort_key, order in self.orders.items():
+            for i in order:
+                group = groups.setdefault(key(self.repos[i]), {})
+                group.setdefault(sort_key, []).append(i)
+        return groups
+
+    def query(
+        self,
+        page: int = 1,
+        pagelen: int = 10,
+        project: str | None = None,
+        name_prefix: str | None = None,
+        language: str | None = None,
+        sort: RepositorySort = RepositorySort.name,
+    ) -> Tuple[int, List[Repository]]:
+        """Return the number of matching repositories and the requested page."""
+
+        candidates: List[List[int]] = []
+        if project is not None:
+            candidates.append(self.by_project.get(project, {}).get(sort.field, []))
+        if language is not None:
+            candidates.append(
+                self.by_language.get(language.lower(), {}).get(sort.field, [])
+            )
+
+        predicates: List[Callable[[Repository], bool]] = []
+
+        if candidates:
+            # start from the smallest group and check the other criteria on the way
+            sequence = min(candidates, key=len)
+            if project is not None and sequence is not candidates[0]:
+                predicates.append(lambda repo: repo.project.key == project)
+            if language is not None and sequence is not candidates[-1]:
+                predicates.append(
+                    lambda repo: repo.language.lower() == language.lower()
+                )
+            if name_prefix is not None:
+                prefix = name_prefix.lower()
+                predicates.append(lambda repo: repo.name.lower().startswith(prefix))
+        elif name_prefix is not None and sort.field == "name":
+            # names with a given prefix are contiguous in the name order
+            prefix = name_prefix.lower()
+            start = bisect_left(self.lowercase_names, prefix)
+            end = bisect_left(self.lowercase_names, prefix + "\uffff", lo=start)
+            sequence = self.orders["name"][start:end]
+        else:
+            sequence = self.orders[sort.field]
+            if name_prefix is not None:
+                prefix = name_prefix.lower()
+                predicates.append(lambda repo: repo.name.lower().startswith(prefix))
+
+        if predicates:
+            sequence = [
+                i
+                for i in sequence
+                if all(predicate(self.repos[i]) for predicate in predicates)
+            ]
+
+        total = len(sequence)
+        start = (page - 1) * pagelen
+        end = start + pagelen
+        if sort.descending:
+            selected = sequence[max(total - end, 0) : max(total - start, 0)][::-1]
+        else:
+            selected = sequence[start:end]
+
+        return total, [self.repos[i] for i in selected]
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+from uuid import uuid4
+
+from .config import JOBS_DIR, JOBS_RETENTION
+from .models.jobs import ItemStatus, Job, JobStatus
+
+# progress is written at most once per SAVE_INTERVAL seconds (and when a job ends)
+SAVE_INTERVAL = 1.0
+
+JobRun = Callable[[Job, "JobManager"], Awaitable[None]]
+
+
+class JobManager:
+    """Runs jobs in the background and keeps their progress on disk.
+
+    A job goes through its items (see set_items), marking each one done or failed
+    as it goes (see mark). Jobs interrupted by a restart are loaded back (see load)
+    and resumed (see resume); a job run only has to handle its pending items.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        retention: float = JOBS_RETENTION,
+        save_interval: float = SAVE_INTERVAL,
+    ):
+        self.path = path
+        self.retention = retention
+        self.save_interval = save_interval
+        # how to run each kind of job
+        self.kinds: Dict[str, JobRun] = {}
+        self.jobs: Dict[str, Job] = {}
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._saved_at: Dict[str, float] = {}
+
+    def register(self, kind: str) -> Callable[[JobRun], JobRun]:
+        """Decorator registering how to run a kind of job."""
+
+        def decorator(run: JobRun) -> JobRun:
+            self.kinds[kind] = run
+            return run
+
+        return decorator
+
+    def get(self, id: str) -> Job | None:
+        return self.jobs.get(id)
+
+    def list(self) -> List[Job]:
+        self._prune()
+        return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def start(self, kind: str, params: Dict[str, Any] | None = None) -> Job:
+        """Start a job in the background, unless the same one is already running."""
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+        params = params or {}
+        self._prune()
+
+        for job in self.jobs.values():
+            if job.kind == kind and job.params == params and not job.finished:
+                return job
+
+        job = Job(id=uuid4().hex, kind=kind, params=params)
+        self.jobs[job.id] = job
+        self.save(job, force=True)
+        self._run(job)
+        return job
+
+    def set_items(self, job: Job, items: Iterable[str]) -> None:
+        """Set the items the job goes through (all pending)."""
+        job.items = {item: ItemStatus.pending for item in items}
+        job.errors = {}
+        self.save(job, force=True)
+
+    def mark(self, job: Job, item: str, error: str | None = None) -> None:
+        """Mark an item as done, or as failed with `error`."""
+        if error is None:
+            job.items[item] = ItemStatus.done
+            job.errors.pop(item, None)
+        else:
+            job.items[item] = ItemStatus.failed
+            job.errors[item] = error
+        self.save(job)
+
+    async def wait(self, job: Job, timeout: float | None = None) -> bool:
+        """Wait (at most `timeout` seconds) for a job to end; return whether it did.
+
+        The job keeps running after the timeout.
+        """
+        task = self._tasks.get(job.id)
+        if task is not None:
+            await asyncio.wait({task}, timeout=timeout)
+        return job.finished
+
+    def _run(self, job: Job) -> None:
+        task = asyncio.create_task(self._execute(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+
+    async def _execute(self, job: Job) -> None:
+        job.status = JobStatus.running
+        self.save(job, force=True)
+        try:
+            await self.kinds[job.kind](job, self)
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.kind}) failed")
+            job.status = JobStatus.failed
+            job.error = str(e)
+        else:
+            job.status = JobStatus.done
+        finally:
+            # when cancelled (eg: on shutdown), the job stays "running" and is
+            # resumed on the next startup
+            self.save(job, force=True)
+
+    def _file(self, job_id: str) -> str:
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def save(self, job: Job, force: bool = False) -> None:
+        """Write the job to disk (at most once per save_interval, unless `force`)."""
+        job.updated_at = datetime.utcnow()
+        if not self.path:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._saved_at.get(job.id, 0.0) < self.save_interval:
+            return
+        self._saved_at[job.id] = now
+
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self._file(job.id)}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(job.json())
+        os.replace(tmp_path, self._file(job.id))
+
+    def load(self) -> int:
+        """Load the jobs saved on disk; return the number of unfinished ones.
+
+        Finished jobs older than `retention` are deleted (see _prune).
+        """
+        if not self.path or not os.path.isdir(self.path):
+            return 0
+
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            file = os.path.join(self.path, name)
+            try:
+                job = Job.parse_file(file)
+            except Exception as e:
+                logging.warning(f"Ignoring invalid job file {file}: {e}")
+                continue
+            self.jobs[job.id] = job
+
+        self._prune()
+        return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def _prune(self) -> None:
+        """Forget the jobs finished more than `retention` seconds ago."""
+        expired = datetime.utcnow() - timedelta(seconds=self.retention)
+        for job in list(self.jobs.values()):
+            if not (job.finished and job.updated_at < expired):
+                continue
+            del self.jobs[job.id]
+            self._saved_at.pop(job.id, None)
+            if self.path and os.path.exists(self._file(job.id)):
+                os.remove(self._file(job.id))
+
+    async def resume(self) -> None:
+        """Run the unfinished jobs again, from where they stopped."""
+        for job in self.jobs.values():
+            if job.finished or job.id in self._tasks:
+                continue
+            if job.kind not in self.kinds:
+                logging.warning(f"Not resuming job {job.id}: unknown kind {job.kind}")
+                continue
+            logging.info(f"Resuming job {job.id} ({job.kind})")
+            self._run(job)
+
+
+job_manager = JobManager(JOBS_DIR)
@@ -7,7 +7,10 @@ from fastapi import FastAPI
 from .api.v1.router import router
 from .client import setup_bb_client
 from .config import API_V1_STR, WEBHOOKS_API_STR, config
+from .jobs import job_manager
+from .snapshot import catalog_snapshot
 from .webhooks_server.app import app as webhooks_server
+from .webhooks_server.app import recover_webhook_events
 
 app = FastAPI()
 
@@ -18,6 +21,15 @@ def init_app(config, core_sccs, loop) -> None:
 
     setup_bb_client(config=config, core_sccs=core_sccs, loop=loop)
 
+    # serve the catalog from the last snapshot right away, then reconcile it with
+    # Bitbucket in the background once the server is up
+    if catalog_snapshot.load():
+        app.add_event_handler("startup", catalog_snapshot.reconcile)
+
+    # pick up the jobs interrupted by the last shutdown where they stopped
+    if job_manager.load():
+        app.add_event_handler("startup", job_manager.resume)
+
     app.include_router(router, prefix=API_V1_STR)
 
     # check if we need to start the hooks server
@@ -35,6 +47,9 @@ def mount_webhooks_server(app: FastAPI):
     # we would need to update the urls for all existing subscriptions.
 
     app.mount(WEBHOOKS_API_STR, webhooks_server)
+    # the lifespan events of a mounted app aren't run: start handling the events
+    # (beginning with those the last run didn't have time to) from the main app
+    app.add_event_handler("startup", recover_webhook_events)
     logging.debug("Mounted webhooks server")
 
 
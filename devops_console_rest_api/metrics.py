@@ -0,0 +1,85 @@
+import bisect
+import threading
+from typing import Any, Dict, Sequence
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# upper bounds of the in-flight calls histogram buckets
+IN_FLIGHT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current values; bucket counts are cumulative (ie: observations <= bound)."""
+        with self._lock:
+            buckets = {}
+            total = 0
+            for bound, count in zip([*self.bounds, "+Inf"], self.counts):
+                total += count
+                buckets[str(bound)] = total
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "buckets": buckets,
+            }
+
+
+class MethodMetrics:
+    """Latency, concurrency and timeouts of the calls to one bridged method."""
+
+    def __init__(self):
+        # time between the call being submitted and the core loop starting it
+        self.queued = Histogram()
+        # time spent running on the core loop
+        self.execution = Histogram()
+        # time a call of a batch (see Client.map) waited on the core loop for its
+        # turn: a concurrency slot, or the budget of the rate limiter
+        self.waiting = Histogram()
+        # number of calls in flight, sampled each time a call is submitted
+        self.in_flight = Histogram(IN_FLIGHT_BUCKETS)
+        self.current_in_flight = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def submitted(self, n: int = 1) -> None:
+        with self._lock:
+            self.current_in_flight += n
+            in_flight = self.current_in_flight
+        self.in_flight.observe(in_flight)
+
+    def finished(self, n: int = 1) -> None:
+        with self._lock:
+            self.current_in_flight -= n
+
+    def timed_out(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued.snapshot(),
+            "execution": self.execution.snapshot(),
+            "waiting": self.waiting.snapshot(),
+            "in_flight": self.in_flight.snapshot(),
+            "current_in_flight": self.current_in_flight,
+            "timeouts": self.timeouts,
+        }
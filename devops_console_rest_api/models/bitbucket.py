@@ -171,6 +171,41 @@ class PaginatedRepositories(BaseModel):
     values: List[Repository]
 
 
+class RepositoryBatchGet(BaseModel):
+    """Payload for getting several repositories at once"""
+
+    uuids: List[UUID4] = Field([], max_items=100)
+    names: List[str] = Field([], max_items=100)
+
+
+class RepositoryBatchPost(BaseModel):
+    """Payload for creating several repositories at once"""
+
+    repositories: List[RepositoryPost] = Field(..., min_items=1, max_items=100)
+
+
+class BatchError(BaseModel):
+    """Why an item of a batch failed"""
+
+    status: int
+    detail: str
+
+
+class RepositoryBatchItem(BaseModel):
+    """The outcome of one item of a batch (by uuid or by name)"""
+
+    uuid: UUID4 | None
+    name: str | None
+    repository: Repository | None
+    error: BatchError | None
+
+
+class RepositoryBatch(BaseModel):
+    """The outcomes of a batch, in the order of the request (uuids, then names)"""
+
+    values: List[RepositoryBatchItem]
+
+
 BaseCommit.update_forward_refs()
 Commit.update_forward_refs()
 Repository.update_forward_refs()
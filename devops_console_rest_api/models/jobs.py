@@ -0,0 +1,75 @@
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, Field
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ItemStatus(str, Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+class Job(BaseModel):
+    """A background operation over many items (eg: one per repository)"""
+
+    id: str
+    kind: str
+    params: Dict[str, Any] = {}
+    status: JobStatus = JobStatus.pending
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # why the job as a whole failed, if it did
+    error: str | None = None
+    items: Dict[str, ItemStatus] = {}
+    # why each failed item failed
+    errors: Dict[str, str] = {}
+    # what the job produced, if anything (eg: a plan)
+    result: Dict[str, Any] | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.done, JobStatus.failed)
+
+    def pending_items(self) -> List[str]:
+        return [
+            item for item, status in self.items.items() if status == ItemStatus.pending
+        ]
+
+    def summary(self) -> "JobSummary":
+        counts = {status: 0 for status in ItemStatus}
+        for status in self.items.values():
+            counts[status] += 1
+        return JobSummary(
+            **self.dict(exclude={"items"}),
+            total=len(self.items),
+            done=counts[ItemStatus.done],
+            failed=counts[ItemStatus.failed],
+            pending=counts[ItemStatus.pending],
+        )
+
+
+class JobSummary(BaseModel):
+    """The progress of a job"""
+
+    id: str
+    kind: str
+    params: Dict[str, Any]
+    status: JobStatus
+    created_at: datetime
+    updated_at: datetime
+    error: str | None
+    total: int
+    done: int
+    failed: int
+    pending: int
+    errors: Dict[str, str]
+    result: Dict[str, Any] | None
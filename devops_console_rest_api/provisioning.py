@@ -0,0 +1,225 @@
+"""Provision repositories: create them, subscribe them to the default webhooks, and
+run the post-steps, each step being retried on transient errors."""
+
+import asyncio
+from dataclasses import dataclass
+from http import HTTPStatus
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from .cache import repositories_cache
+from .client import bitbucket_client as client
+from .config import (
+    PROVISIONING_CONCURRENCY,
+    WEBHOOKS_DEFAULT_DESCRIPTION,
+    WEBHOOKS_DEFAULT_EVENTS,
+    WEBHOOKS_URL,
+)
+from .jobs import JobManager, job_manager
+from .models.bitbucket import RepositoryPost
+from .models.jobs import Job
+from .ratelimit import webhooks_rate_limiter
+
+PROVISION = "provision_repositories"
+
+# attempts of a step after the first one, and the delay before the first retry
+# (doubled for each retry)
+STEP_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+# outputs of the steps done so far, by step name
+Outputs = Dict[str, Any]
+
+
+def _retryable(e: Exception) -> bool:
+    """Transient errors: timeouts, rate limiting and server errors."""
+    status = getattr(e, "status", None)
+    return status == HTTPStatus.TOO_MANY_REQUESTS or _failed_upstream(e)
+
+
+def _failed_upstream(e: Exception) -> bool:
+    """Timeouts and server errors (rate limiting aside)."""
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    status = getattr(e, "status", None)
+    return isinstance(status, int) and status >= 500
+
+
+@dataclass
+class Step:
+    name: str
+    run: Callable[[RepositoryPost, Outputs], Awaitable[Any]]
+    retries: int = STEP_RETRIES
+    # which errors the step is retried on
+    retryable: Callable[[Exception], bool] = _retryable
+    # for a step that isn't idempotent: called before each attempt, returns the
+    # output of the step if it already took effect (eg: done before a restart, or
+    # by an attempt that timed out once done), None otherwise
+    check: Callable[[RepositoryPost], Awaitable[Any]] | None = None
+
+
+class StepFailed(Exception):
+    def __init__(self, step: str, error: Exception):
+        super().__init__(f"{step}: {error}")
+        self.step = step
+        self.error = error
+
+
+async def create_repository(repo: RepositoryPost, outputs: Outputs) -> Any:
+    # the core sccs only creates the repository if it doesn't exist
+    created = await client.add_repository(
+        repository=repo.dict(),
+        template="empty-repo-for-applications",
+        template_params={},
+        args=None,
+    )
+    if not created:
+        raise ValueError("Failed to create repository")
+    return created
+
+
+async def subscribe_webhooks(repo: RepositoryPost, outputs: Outputs) -> Any:
+    # rate limiting is retried by the limiter
+    return await webhooks_rate_limiter.call(
+        lambda: client.create_webhook_subscription(
+            repo_name=repo.name,
+            url=WEBHOOKS_URL,
+            active=True,
+            events=WEBHOOKS_DEFAULT_EVENTS,
+            description=WEBHOOKS_DEFAULT_DESCRIPTION,
+            args=None,
+        )
+    )
+
+
+async def find_webhook_subscription(repo: RepositoryPost) -> Any:
+    subscriptions = await webhooks_rate_limiter.call(
+        lambda: client.get_webhook_subscriptions(repo_name=repo.name)
+    )
+    return next(
+        (
+            subscription
+            for subscription in (subscriptions or {}).get("values", [])
+            if subscription["url"] == WEBHOOKS_URL
+        ),
+        None,
+    )
+
+
+async def refresh_catalog(repo: RepositoryPost, outputs: Outputs) -> None:
+    # in the background; the refreshes of a batch are coalesced into one
+    repositories_cache.refresh()
+
+
+# the steps, in order; post-steps are appended to the list
+STEPS: List[Step] = [
+    Step("create_repository", create_repository),
+    # a subscription made twice would send every event twice
+    Step(
+        "subscribe_webhooks",
+        subscribe_webhooks,
+        retryable=_failed_upstream,
+        check=find_webhook_subscription,
+    ),
+    Step("refresh_catalog", refresh_catalog, retries=0),
+]
+
+
+async def _run_step(step: Step, repo: RepositoryPost, outputs: Outputs) -> Any:
+    for attempt in range(step.retries + 1):
+        try:
+            if step.check is not None:
+                output = await step.check(repo)
+                if output is not None:
+                    return output
+            return await step.run(repo, outputs)
+        except Exception as e:
+            if attempt == step.retries or not step.retryable(e):
+                raise
+            delay = RETRY_BACKOFF * 2**attempt
+            logging.warning(
+                f"Step {step.name} failed for {repo.name} ({e}), retrying in {delay}s"
+            )
+            await asyncio.sleep(delay)
+
+
+async def provision(
+    repo: RepositoryPost,
+    outputs: Outputs | None = None,
+    on_step: Callable[[str, Exception | None], None] | None = None,
+    until: str | None = None,
+) -> Outputs:
+    """Run the steps for a repository, skipping those already in `outputs`.
+
+    `outputs` is filled as the steps are done, and `on_step` is called with the
+    name of each step and the error it failed with (if it did). Raise StepFailed
+    for the first step that fails (after its retries); the next ones aren't run.
+    With `until`, the steps after the one of that name aren't run either.
+    """
+    outputs = {} if outputs is None else outputs
+    steps = STEPS
+    if until is not None:
+        steps = STEPS[: [step.name for step in STEPS].index(until) + 1]
+
+    for step in steps:
+        if step.name in outputs:
+            continue
+        try:
+            outputs[step.name] = await _run_step(step, repo, outputs)
+        except Exception as e:
+            logging.error(f"Failed to provision {repo.name}, step {step.name}: {e}")
+            if on_step is not None:
+                on_step(step.name, e)
+            raise StepFailed(step.name, e) from e
+        if on_step is not None:
+            on_step(step.name, None)
+    return outputs
+
+
+@job_manager.register(PROVISION)
+async def provision_batch(job: Job, jobs: JobManager) -> None:
+    """Provision the `repositories` (RepositoryPost payloads) of the job parameters,
+    PROVISIONING_CONCURRENCY at a time.
+
+    The job result has the status of each step of each repository, and the outputs
+    of the steps done (eg: the created repository). The `outputs` parameter (by
+    repository name) has those of the steps already done, if any.
+    """
+    repos = [RepositoryPost.parse_obj(repo) for repo in job.params["repositories"]]
+    if not job.items:
+        done = job.params.get("outputs", {})
+        outputs = {repo.name: dict(done.get(repo.name, {})) for repo in repos}
+        job.result = {
+            "steps": {
+                name: {
+                    step.name: "done" if step.name in outputs[name] else "pending"
+                    for step in STEPS
+                }
+                for name in outputs
+            },
+            "outputs": outputs,
+        }
+        jobs.set_items(job, [repo.name for repo in repos])
+
+    semaphore = asyncio.Semaphore(PROVISIONING_CONCURRENCY)
+    pending = set(job.pending_items())
+
+    async def provision_one(repo: RepositoryPost):
+        steps = job.result["steps"][repo.name]
+
+        def on_step(name: str, error: Exception | None):
+            steps[name] = "done" if error is None else "failed"
+            # don't redo a step (eg: create the repository again) after a restart
+            jobs.save(job, force=True)
+
+        async with semaphore:
+            try:
+                await provision(repo, job.result["outputs"][repo.name], on_step)
+            except StepFailed as e:
+                jobs.mark(job, repo.name, error=str(e))
+            else:
+                jobs.mark(job, repo.name)
+
+    await asyncio.gather(
+        *[provision_one(repo) for repo in repos if repo.name in pending]
+    )
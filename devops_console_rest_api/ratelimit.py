@@ -0,0 +1,151 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping
+
+from .config import (
+    WEBHOOKS_RATE_LIMIT,
+    WEBHOOKS_RATE_LIMIT_BURST,
+    WEBHOOKS_RATE_LIMIT_PERIOD,
+)
+
+
+def _headers(exc: Exception) -> Mapping[str, str]:
+    """The response headers carried by an upstream error, if any."""
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    return headers or {}
+
+
+def retry_after(headers: Mapping[str, str]) -> float | None:
+    """Seconds to wait according to a Retry-After header (delay or HTTP date)."""
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket keeping upstream calls within a budget per period.
+
+    The bucket holds up to `burst` tokens and refills at (budget - burst) / period,
+    so no window of `period` seconds ever sees more than `budget` calls. A call
+    reserves its token before waiting for it (see reserve), so concurrent callers
+    are served in order without polling.
+
+    Calls rejected with a 429 are retried after the delay given by Retry-After
+    (or an exponential backoff without it); meanwhile, every caller is paused,
+    since they share the same upstream budget.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        period: float,
+        burst: int | None = None,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if budget < 2:
+            raise ValueError("The budget must allow at least 2 calls per period")
+        self.budget = budget
+        self.period = period
+        burst = burst if burst is not None else budget // 10
+        self.burst = max(min(burst, budget - 1), 1)
+        self.rate = (budget - self.burst) / period  # tokens per second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self._tokens = float(self.burst)
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "waits": 0, "waited": 0.0, "rate_limited": 0}
+
+    def reserve(self) -> float:
+        """Take a token; return how long to wait before using it."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self._tokens + (now - self._updated_at) * self.rate, self.burst
+            )
+            self._updated_at = now
+            self._tokens -= 1
+
+            delay = max(-self._tokens / self.rate, self._paused_until - now, 0.0)
+            self._stats["calls"] += 1
+            if delay > 0:
+                self._stats["waits"] += 1
+                self._stats["waited"] += delay
+            return delay
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for `seconds`."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Align the bucket with the rate-limit headers of an upstream response."""
+        for name, value in headers.items():
+            if name.lower() == "x-ratelimit-remaining":
+                try:
+                    remaining = float(value)
+                except ValueError:
+                    continue
+                with self._lock:
+                    self._tokens = min(self._tokens, remaining)
+
+    async def call(self, f: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `f()` within the budget, retrying it when rate limited."""
+        attempt = 0
+        while True:
+            await self.acquire()
+            try:
+                return await f()
+            except Exception as e:
+                headers = _headers(e)
+                self.observe(headers)
+                if getattr(e, "status", None) != HTTPStatus.TOO_MANY_REQUESTS:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+
+                delay = retry_after(headers)
+                if delay is None:
+                    delay = min(self.backoff * 2**attempt, self.max_backoff)
+                logging.warning(f"Rate limited, retrying in {delay:.1f}s")
+                with self._lock:
+                    self._stats["rate_limited"] += 1
+                self.pause(delay)
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "tokens": self._tokens}
+
+
+# the webhooks API allows WEBHOOKS_RATE_LIMIT calls per WEBHOOKS_RATE_LIMIT_PERIOD,
+# shared by everything calling it
+webhooks_rate_limiter = RateLimiter(
+    WEBHOOKS_RATE_LIMIT, WEBHOOKS_RATE_LIMIT_PERIOD, burst=WEBHOOKS_RATE_LIMIT_BURST
+)
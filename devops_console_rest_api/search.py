@@ -0,0 +1,195 @@
+import heapq
+import re
+from typing import Dict, Iterator, List, Set, Tuple
+
+from .cache import RepositoryCache, repository_cache
+from .models.bitbucket import Repository
+
+# weight of a match in each field of a repository
+FIELD_WEIGHTS: Dict[str, float] = {
+    "name": 4.0,
+    "project.key": 2.0,
+    "project.name": 2.0,
+    "description": 1.0,
+    "project.description": 0.5,
+}
+
+# a whole word matches better than a fragment of a word
+WORD_BOOST = 2.0
+
+NGRAM = 3
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of `text` (split on anything that isn't a letter or digit)."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def _texts(repo: Repository) -> Tuple[str, ...]:
+    """The searchable texts of a repository, in the order of FIELD_WEIGHTS."""
+    project = repo.project
+    return (
+        repo.name,
+        project.key,
+        project.name or "",
+        # not part of the model, but Bitbucket sends it (and extra fields are kept)
+        getattr(repo, "description", "") or "",
+        project.description,
+    )
+
+
+def _grams(word: str) -> Iterator[str]:
+    """The keys a word is found by: its n-grams, and its prefixes shorter than a
+    n-gram (a fragment that short can't be looked up by n-grams)."""
+    for i in range(1, min(len(word), NGRAM - 1) + 1):
+        yield f"^{word[:i]}"
+    for i in range(len(word) - NGRAM + 1):
+        yield word[i : i + NGRAM]
+
+
+class RepositorySearchIndex:
+    """Inverted index over the words (and fragments of words) of repositories.
+
+    Each word maps to the repositories containing it (with the weight of the best
+    field it appears in), and each n-gram to the words containing it. Repositories
+    are (re)indexed one at a time, as the repository cache changes; nothing is ever
+    rebuilt from scratch.
+
+    A query matches the repositories containing every word of the query, where a
+    word can be a fragment of a word of the repository (eg: "serv" matches
+    "my-service"). Fragments shorter than a n-gram only match the start of a word.
+    """
+
+    def __init__(self):
+        self.repos: Dict[str, Repository] = {}
+        # word: {repository key: weight}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        # n-gram or prefix: words
+        self.grams: Dict[str, Set[str]] = {}
+        # what each repository was indexed with, to reindex or unindex it
+        self._texts: Dict[str, Tuple[str, ...]] = {}
+        self._words: Dict[str, Dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.repos)
+
+    def attach(self, cache: RepositoryCache) -> None:
+        """Follow the changes of a repository cache."""
+        for key, repo in cache.items():
+            self.put(key, repo)
+        cache.listeners.append(self._on_change)
+
+    def _on_change(self, key: str, repo: Repository | None) -> None:
+        if repo is None:
+            self.remove(key)
+        else:
+            self.put(key, repo)
+
+    def put(self, key: str, repo: Repository) -> None:
+        """Index a repository (replacing its previous version, if any)."""
+        self.repos[key] = repo
+
+        texts = _texts(repo)
+        if self._texts.get(key) == texts:
+            return
+        self._texts[key] = texts
+
+        words: Dict[str, float] = {}
+        for text, weight in zip(texts, FIELD_WEIGHTS.values()):
+            for word in tokenize(text):
+                if words.get(word, 0.0) < weight:
+                    words[word] = weight
+
+        previous = self._words.get(key, {})
+        for word in previous.keys() - words.keys():
+            self._unpost(word, key)
+        for word, weight in words.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                for gram in _grams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+            self.postings[word][key] = weight
+        self._words[key] = words
+
+    def remove(self, key: str) -> None:
+        """Unindex a repository."""
+        self.repos.pop(key, None)
+        self._texts.pop(key, None)
+        for word in self._words.pop(key, {}):
+            self._unpost(word, key)
+
+    def _unpost(self, word: str, key: str) -> None:
+        posting = self.postings[word]
+        posting.pop(key, None)
+        if posting:
+            return
+
+        # the word isn't used anymore
+        del self.postings[word]
+        for gram in _grams(word):
+            words = self.grams[gram]
+            words.discard(word)
+            if not words:
+                del self.grams[gram]
+
+    def _words_matching(self, token: str) -> Set[str]:
+        """The indexed words containing `token` (or starting with it, if short)."""
+        if len(token) < NGRAM:
+            return self.grams.get(f"^{token}", set())
+
+        candidates = sorted(
+            (
+                self.grams.get(token[i : i + NGRAM], set())
+                for i in range(len(token) - NGRAM + 1)
+            ),
+            key=len,
+        )
+        words = candidates[0].intersection(*candidates[1:])
+        if len(token) > NGRAM:
+            # having every n-gram of the token doesn't mean having the token
+            words = {word for word in words if token in word}
+        return words
+
+    def _match(self, token: str) -> Dict[str, float]:
+        """The score of each repository matching `token`."""
+        scores: Dict[str, float] = {}
+        for word in self._words_matching(token):
+            boost = WORD_BOOST if word == token else 1.0
+            for key, weight in self.postings[word].items():
+                score = weight * boost
+                if scores.get(key, 0.0) < score:
+                    scores[key] = score
+        return scores
+
+    def search(self, query: str, limit: int = 20) -> Tuple[int, List[Repository]]:
+        """Return the number of matching repositories and the best `limit` ones."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, []
+
+        scores: Dict[str, float] | None = None
+        for token in tokens:
+            match = self._match(token)
+            if scores is None:
+                scores = match
+            else:
+                scores = {
+                    key: score + match[key]
+                    for key, score in scores.items()
+                    if key in match
+                }
+            if not scores:
+                return 0, []
+
+        best = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], self.repos[item[0]].name.lower()),
+        )
+        return len(scores), [self.repos[key] for key, _ in best]
+
+
+repository_search = RepositorySearchIndex()
+repository_search.attach(repository_cache)
@@ -0,0 +1,90 @@
+from typing import Any, AsyncIterator, Dict, Iterable, List, Type
+
+from fastapi import Response
+import orjson
+from pydantic import BaseModel
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# the `include` argument of BaseModel.dict(), eg: {"name": True, "project": {"key": True}}
+Include = Dict[str, Any]
+
+
+def parse_fields(fields: str, model: Type[BaseModel]) -> Include:
+    """Turn a `fields` parameter (eg: "name,project.key") into an `Include`.
+
+    Raise ValueError for an unknown (top-level) field.
+    """
+    include: Include = {}
+    for path in filter(None, (path.strip() for path in fields.split(","))):
+        *parents, leaf = path.split(".")
+        if (parents[0] if parents else leaf) not in model.__fields__:
+            raise ValueError(f"Unknown field: {path}")
+
+        node = include
+        for parent in parents:
+            if node.get(parent) is True:
+                break  # the whole parent is already included
+            node = node.setdefault(parent, {})
+        else:
+            node[leaf] = True
+
+    return include
+
+
+def _default(obj: Any) -> Any:
+    """Serialize what orjson doesn't support natively."""
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    return str(obj)
+
+
+def dumps(model: BaseModel, include: Include | None = None) -> bytes:
+    """Serialize an (already validated) model to JSON.
+
+    With `include`, only those fields are serialized; the others (including whole
+    nested models) are skipped.
+    """
+    return orjson.dumps(model.dict(include=include), default=_default)
+
+
+def dumps_listing(
+    values: List[BaseModel],
+    include: Include | None = None,
+    page: Dict[str, Any] | None = None,
+) -> bytes:
+    """Serialize (already validated) models as a list, or as a page of a listing.
+
+    `page` holds the other fields of the page (see `Paginated`).
+    """
+    content = [value.dict(include=include) for value in values]
+    if page is not None:
+        content = {**page, "values": content}
+    return orjson.dumps(content, default=_default)
+
+
+class ModelResponse(Response):
+    """JSON response for models that are already validated (eg: cached ones).
+
+    Returning a Response bypasses the endpoint's `response_model`, so the models are
+    not validated and copied a second time on the way out; `response_model` is then
+    only used for the OpenAPI spec.
+    """
+
+    media_type = JSON_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        if isinstance(content, BaseModel):
+            return dumps(content)
+        return orjson.dumps(content, default=_default)
+
+
+async def ndjson_lines(
+    models: Iterable[BaseModel], include: Include | None = None
+) -> AsyncIterator[bytes]:
+    """One JSON document per line, serialized as the response is sent."""
+    for model in models:
+        yield dumps(model, include) + b"\n"
@@ -0,0 +1,141 @@
+import asyncio
+from functools import cached_property
+import hashlib
+import logging
+import os
+import time
+import zlib
+from typing import Dict
+
+import orjson
+
+from .cache import ListingCache, projects_cache, repositories_cache
+from .config import CATALOG_SNAPSHOT_MAX_AGE, CATALOG_SNAPSHOT_PATH
+
+# bump when the layout of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+
+class CatalogSnapshot:
+    """On-disk copy of the cached listings, to serve something right after startup.
+
+    The snapshot is zlib-compressed JSON stamped with SNAPSHOT_VERSION and a
+    fingerprint of the models' schemas; a snapshot with another stamp, older than
+    `max_age` or that fails to load is ignored.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        caches: Dict[str, ListingCache],
+        max_age: float = CATALOG_SNAPSHOT_MAX_AGE,
+    ):
+        self.path = path
+        self.caches = caches
+        self.max_age = max_age
+
+        self._loading = False
+        self._saving: asyncio.Future | None = None
+        self._dirty = False
+
+        for cache in caches.values():
+            cache.listeners.append(lambda _: self.schedule_save())
+
+    @cached_property
+    def stamp(self) -> str:
+        schemas = "".join(cache.model.schema_json() for cache in self.caches.values())
+        return f"{SNAPSHOT_VERSION}:{hashlib.sha1(schemas.encode()).hexdigest()}"
+
+    def load(self) -> bool:
+        """Fill the caches from the snapshot; return whether it was used."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, "rb") as f:
+                decompressor = zlib.decompressobj()
+                data = decompressor.decompress(f.read())
+            if not decompressor.eof or decompressor.unused_data:
+                raise ValueError("truncated or trailing data")
+            snapshot = orjson.loads(data)
+
+            if snapshot["stamp"] != self.stamp:
+                logging.info("Ignoring catalog snapshot made by another version")
+                return False
+            if time.time() - snapshot["written_at"] > self.max_age:
+                logging.info("Ignoring outdated catalog snapshot")
+                return False
+
+            # consider the listings stale: they are served right away, but the first
+            # read triggers a refresh
+            self._loading = True
+            for name, cache in self.caches.items():
+                cache.set(
+                    snapshot["listings"][name],
+                    fetched_at=time.monotonic() - cache.ttl,
+                )
+        except Exception as e:
+            logging.warning(f"Ignoring invalid catalog snapshot {self.path}: {e}")
+            return False
+        finally:
+            self._loading = False
+
+        logging.info(f"Loaded catalog snapshot {self.path}")
+        return True
+
+    def save(self) -> None:
+        """Write the cached listings to the snapshot (atomically)."""
+        listings = {}
+        for name, cache in self.caches.items():
+            listing = cache.listing
+            if listing is None:
+                return  # wait until we have everything
+            listings[name] = [value.dict() for value in listing.values]
+
+        data = zlib.compress(
+            orjson.dumps(
+                {"stamp": self.stamp, "written_at": time.time(), "listings": listings}
+            )
+        )
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def schedule_save(self) -> None:
+        """Save the snapshot in a worker thread (at most one save at a time)."""
+        if not self.path or self._loading:
+            return
+
+        if self._saving is not None and not self._saving.done():
+            self._dirty = True
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+
+        self._dirty = False
+        self._saving = loop.run_in_executor(None, self.save)
+        self._saving.add_done_callback(self._saved)
+
+    def _saved(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"Failed to save catalog snapshot: {future.exception()}")
+        if self._dirty:
+            self.schedule_save()
+
+    async def reconcile(self) -> None:
+        """Refresh the listings loaded from the snapshot, in the background."""
+        for cache in self.caches.values():
+            cache.refresh()
+
+
+catalog_snapshot = CatalogSnapshot(
+    CATALOG_SNAPSHOT_PATH,
+    {"repositories": repositories_cache, "projects": projects_cache},
+)
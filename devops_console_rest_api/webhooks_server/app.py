@@ -1,133 +1,252 @@
+import asyncio
+from datetime import datetime
 import logging
 from http import HTTPStatus
+import time
 
 from fastapi import FastAPI, HTTPException, Request
-from requests import JSONDecodeError
 
+from ..cache import repository_cache
 from ..client import bitbucket_client as client
-from ..models.webhooks import (
-    PRApprovedEvent,
-    PRCreatedEvent,
-    PRDeclinedEvent,
-    PRMergedEvent,
-    PRUpdatedEvent,
-    RepoBuildStatusCreated,
-    RepoBuildStatusUpdated,
-    RepoPushEvent,
-    WebhookEventKey,
-)
+from ..jobs import JobManager, job_manager
+from ..models.jobs import Job, JobSummary
+from ..models.webhooks import WebhookEventKey
+from .coalesce import Coalescer
+from .deliveries import deliveries, delivery_key
+from .events import Event
+from .journal import journal
+from .registry import handlers
+from .work_queue import WorkQueue
 
 app = FastAPI()
 
 
 @app.post("/", tags=["bitbucket_webhooks"])
 async def handle_webhook_event(request: Request):
-    """Receive and respond to a Bitbucket webhook event.
+    """Receive a Bitbucket webhook event and queue it for handling.
 
     This endpoint (ie: "/bitbucketcloud/hooks/repo") is the entry point for the
-    default devops webhook subscriptions.
+    default devops webhook subscriptions. It only checks the event key and that
+    the body looks like a JSON object, and writes the event to the journal before
+    answering: the event is parsed and handled by the workers of the queue.
+
+    Deliveries retried by Bitbucket are acknowledged without reading them again.
     """
 
-    event_key = request.headers["X-Event-Key"]
+    event_key = request.headers.get("X-Event-Key")
     logging.info(f'Received webhook with event key "{event_key}"')
 
+    delivery = delivery_key(request.headers)
+    if delivery is not None and deliveries.seen(delivery):
+        logging.info(f"Ignoring delivery {delivery}, already received")
+        return "OK"
+
     try:
-        body = await request.json()
-    except JSONDecodeError as e:
-        logging.warning(f"Error parsing JSON: {e}")
+        await _accept(request, event_key, delivery)
+    except BaseException:
+        # not accepted (refused, or eg: the journal couldn't be written): let it be
+        # delivered again
+        if delivery is not None:
+            deliveries.forget(delivery)
+        raise
+
+    return "OK"
+
+
+async def _accept(request: Request, event_key: str | None, delivery: str | None):
+    if event_key not in handlers:
+        msg = f"Unsupported event key: {event_key}"
+        logging.warning(msg)
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=msg)
+
+    body = await request.body()
+    if not body.lstrip().startswith(b"{"):
+        logging.warning(f"Invalid JSON: {body[:100]!r}")
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid JSON")
+
+    if work_queue.full():
+        _refuse(event_key)
+
+    offset = await journal.append(event_key, body, delivery)
+    if not work_queue.put(event_key, body, offset):
+        # filled up in the meantime: Bitbucket will deliver it again
+        if offset is not None:
+            journal.done(offset)
+        _refuse(event_key)
+
+
+def _refuse(event_key: str):
+    logging.warning(f'Webhook queue full, refusing "{event_key}" event')
+    raise HTTPException(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        detail="Too many events, try again later",
+        headers={"Retry-After": "10"},
+    )
+
+
+@app.get("/stats", tags=["bitbucket_webhooks"])
+async def get_stats():
+    """Depth, lag and throughput of the webhook event queue, journal offsets,
+    duplicate deliveries, coalesced events, and the latency of each handler."""
+    return {
+        "queue": work_queue.stats(),
+        "journal": journal.stats(),
+        "deliveries": deliveries.stats(),
+        "coalescer": coalescer.stats(),
+        "handlers": handlers.stats(),
+    }
+
+
+@app.post(
+    "/replay",
+    tags=["bitbucket_webhooks"],
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=JobSummary,
+)
+async def replay_webhook_events(since: datetime, until: datetime | None = None):
+    """Handle the journaled events received between `since` and `until` again, in
+    a background job (eg: to rebuild caches).
+
+    Follow its progress with `/jobs/{id}` of the API.
+    """
+    if not journal.enabled:
         raise HTTPException(
-            status_code=HTTPStatus.BAD_REQUEST, detail="Error parsing JSON."
+            status_code=HTTPStatus.CONFLICT, detail="The journal is disabled"
         )
+    params = {
+        "since": since.timestamp(),
+        "until": until.timestamp() if until is not None else None,
+    }
+    return job_manager.start(REPLAY, params).summary()
+
+
+async def process_webhook_event(event_key: str, body: bytes):
+    """Parse a queued event and run its handlers (unless it's held back to be
+    coalesced: see Coalescer.handle)."""
+
+    try:
+        event = Event.parse(event_key, body)
+    except ValueError as e:  # including orjson.JSONDecodeError
+        logging.warning(f"Error parsing JSON: {e}")
+        return None
+
+    return await coalescer.handle(event)
+
+
+coalescer = Coalescer(lambda event: handlers.dispatch(event))
+work_queue = WorkQueue(process_webhook_event, done=lambda offset: journal.done(offset))
+
+REPLAY = "replay_webhook_events"
+
+
+@job_manager.register(REPLAY)
+async def replay(job: Job, jobs: JobManager) -> None:
+    """Queue the journaled events received between the `since` and `until`
+    parameters (timestamps) again.
+
+    The result has the offset of the last event queued (a resumed replay goes on
+    from there) and the number of events queued.
+    """
+    result = job.result or {"offset": -1, "replayed": 0}
+    job.result = result
+    for record in journal.read(
+        after=result["offset"], since=job.params["since"], until=job.params["until"]
+    ):
+        # not tracked by the journal: they were handled already
+        await work_queue.put_wait(record.event_key, record.body)
+        result["offset"] = record.offset
+        result["replayed"] += 1
+        jobs.save(job)
+
+
+async def recover_webhook_events():
+    """Start handling webhook events, beginning with those the last run received but
+    didn't handle (on startup).
+
+    The deliveries the last run received are remembered from the journal, to
+    still recognize them if Bitbucket retries them.
+    """
+    work_queue.start()
+    journal.open()
+    for record in journal.read(since=time.time() - deliveries.window):
+        if record.delivery is not None:
+            deliveries.add(record.delivery, record.received_at)
+
+    backlog = journal.stats()["backlog"]
+    if not backlog:
+        return
+    logging.info(f"Handling {backlog} webhook events left by the last run")
+
+    async def requeue():
+        for record in journal.backlog():
+            await work_queue.put_wait(record.event_key, record.body, record.offset)
+
+    asyncio.create_task(requeue())
 
-    if type(body) is not dict:
-        logging.warning(f"Invalid JSON: {body}")
-        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid JSON")
 
-    match event_key:
-        case WebhookEventKey.repo_push:
-            return await handle_repo_push(event=RepoPushEvent(**body))
-        case WebhookEventKey.repo_build_created:
-            return handle_commit_status_created(event=RepoBuildStatusCreated(**body))
-        case WebhookEventKey.repo_build_updated:
-            return handle_build_status_updated(event=RepoBuildStatusUpdated(**body))
-        case WebhookEventKey.pr_created:
-            return handle_pr_created(event=PRCreatedEvent(**body))
-        case WebhookEventKey.pr_updated:
-            return handle_pr_updated(event=PRUpdatedEvent(**body))
-        case WebhookEventKey.pr_approved:
-            return handle_pr_approved(event=PRApprovedEvent(**body))
-        case WebhookEventKey.pr_declined:
-            return handle_pr_declined(event=PRDeclinedEvent(**body))
-        case WebhookEventKey.pr_merged:
-            return handle_pr_merged(event=PRMergedEvent(**body))
-        case _:
-            msg = (f"Unsupported event key: {event_key}",)
-            logging.warning(msg)
-            raise HTTPException(
-                status_code=HTTPStatus.BAD_REQUEST,
-                detail=msg,
-            )
-
-
-async def handle_repo_push(event: RepoPushEvent):
+@handlers.register(WebhookEventKey.repo_push)
+async def handle_repo_push(event: Event):
     """Compare hook data to cached values and update cache accordingly."""
 
     logging.info('Handling "repo:push" webhook event')
 
-    # determine if the push event touches any of the cached values
-    changes_matter = False
-    for push_change in event.push["changes"]:
-        if (
-            push_change.new.type == "branch"
-            and push_change.new.name in client.cd_branches_accepted
-        ):
-            changes_matter = True
-            break
+    # determine if the push event touches any of the cached values (only the
+    # routing fields are needed: the event model isn't built)
+    changes_matter = any(
+        branch in client.cd_branches_accepted for branch in event.branches
+    )
 
     # if the push event doesn't touch any of the cached values, we can skip it
     if not changes_matter:
         logging.info("Push event doesn't touch any of the cached values")
         return "OK"
 
-    # if it does, we need to update the cache
+    # if it does, we need to update the cache (for this repository only)
     logging.info("Push event touches cached values, updating cache")
 
-    client.get_repository.cache_clear()
-    # TODO: determine which other cached functions to clear
+    repository_cache.refresh(event.repository_uuid)
+    # TODO: determine which other cached values to refresh
 
     # TODO: react to the push event appropriately
 
 
-def handle_commit_status_created(event: RepoBuildStatusCreated):
+@handlers.register(WebhookEventKey.repo_build_created)
+def handle_commit_status_created(event: Event):
     logging.info('Handling "repo:build_created" webhook event')
     pass
 
 
-def handle_build_status_updated(event: RepoBuildStatusUpdated):
+@handlers.register(WebhookEventKey.repo_build_updated)
+def handle_build_status_updated(event: Event):
     logging.info('Handling "repo:build_updated" webhook event')
     pass
 
 
-def handle_pr_created(event: PRCreatedEvent):
+@handlers.register(WebhookEventKey.pr_created)
+def handle_pr_created(event: Event):
     logging.info('Handling "pr:created" webhook event')
     pass
 
 
-def handle_pr_updated(event: PRUpdatedEvent):
+@handlers.register(WebhookEventKey.pr_updated)
+def handle_pr_updated(event: Event):
     logging.info('Handling "pr:updated" webhook event')
     pass
 
 
-def handle_pr_merged(event: PRMergedEvent):
+@handlers.register(WebhookEventKey.pr_merged)
+def handle_pr_merged(event: Event):
     logging.info('Handling "pr:merged" webhook event')
     pass
 
 
-def handle_pr_approved(event: PRApprovedEvent):
+@handlers.register(WebhookEventKey.pr_approved)
+def handle_pr_approved(event: Event):
     logging.info('Handling "pr:approved" webhook event')
     pass
 
 
-def handle_pr_declined(event: PRDeclinedEvent):
+@handlers.register(WebhookEventKey.pr_declined)
+def handle_pr_declined(event: Event):
     logging.info('Handling "pr:declined" webhook event')
     pass
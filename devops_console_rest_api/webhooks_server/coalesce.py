@@ -0,0 +1,123 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+
+from ..config import WEBHOOKS_DEBOUNCE_MAX_WAIT, WEBHOOKS_DEBOUNCE_WINDOW
+from ..models.webhooks import WebhookEventKey
+from .events import Event
+
+COMMIT_STATUS_EVENTS = (
+    WebhookEventKey.repo_build_created,
+    WebhookEventKey.repo_build_updated,
+)
+
+
+@dataclass
+class _Held:
+    event: Event  # the newest one
+    handled: asyncio.Future
+    deadline: float  # loop time
+    timer: asyncio.TimerHandle
+
+
+class Coalescer:
+    """Collapses bursts of events about the same thing before they're handled.
+
+    The commit statuses of a commit (a CI run sends many) and the pushes to the
+    same branches of a repository (eg: a merge train) are held until none came
+    for `window` seconds, or for `max_wait` seconds after the first one: only the
+    newest is handled. Other events are handled right away.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[Event], Awaitable[Any]],
+        window: float = WEBHOOKS_DEBOUNCE_WINDOW,
+        max_wait: float = WEBHOOKS_DEBOUNCE_MAX_WAIT,
+    ):
+        self.dispatch = dispatch
+        self.window = window
+        self.max_wait = max(window, max_wait)
+        # the events held back, by key
+        self._pending: Dict[Tuple, _Held] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.received = 0
+        self.dispatched = 0
+
+    @staticmethod
+    def key(event: Event) -> Tuple | None:
+        """What the event is about, if it's coalesced."""
+        repository = event.repository_uuid
+        if repository is None:
+            return None
+        if event.key in COMMIT_STATUS_EVENTS and event.commit is not None:
+            return repository, "commit", event.commit, event.status_key
+        if event.key == WebhookEventKey.repo_push and event.branches:
+            return repository, "branches", *sorted(event.branches)
+        return None
+
+    async def handle(self, event: Event) -> asyncio.Future | None:
+        """Handle the event, or hold it back.
+
+        Return a future completed once a held event (or the newer one replacing it)
+        is handled.
+        """
+        key = self.key(event) if self.window > 0 else None
+        if key is None:
+            await self.dispatch(event)
+            return None
+
+        self.received += 1
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        held = self._pending.get(key)
+        if held is not None:
+            if _newer(event, held.event):
+                held.event = event
+            # the burst goes on: wait for its end, up to the deadline
+            held.timer.cancel()
+            flush_at = min(now + self.window, held.deadline)
+            held.timer = loop.call_at(flush_at, self._flush, key)
+            return held.handled
+
+        held = _Held(
+            event=event,
+            handled=loop.create_future(),
+            deadline=now + self.max_wait,
+            timer=loop.call_at(now + self.window, self._flush, key),
+        )
+        self._pending[key] = held
+        return held.handled
+
+    def _flush(self, key: Tuple) -> None:
+        held = self._pending.pop(key)
+        task = asyncio.create_task(self._dispatch(held.event, held.handled))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, event: Event, handled: asyncio.Future) -> None:
+        self.dispatched += 1
+        try:
+            await self.dispatch(event)
+        finally:
+            handled.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        pending = len(self._pending)
+        collapsed = self.received - self.dispatched - pending
+        return {
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "pending": pending,
+            "collapsed": collapsed,
+            # share of the coalescable events that weren't handled
+            "collapse_ratio": collapsed / self.received if self.received else 0,
+        }
+
+
+def _newer(event: Event, than: Event) -> bool:
+    # commit statuses can arrive out of order; pushes are in order
+    if event.updated_on is None or than.updated_on is None:
+        return True
+    return event.updated_on >= than.updated_on
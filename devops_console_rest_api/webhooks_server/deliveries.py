@@ -0,0 +1,65 @@
+from collections import OrderedDict
+import time
+from typing import Any, Callable, Dict
+
+from ..config import WEBHOOKS_DEDUPE_SIZE, WEBHOOKS_DEDUPE_WINDOW
+
+
+def delivery_key(headers) -> str | None:
+    """What identifies a delivery (Bitbucket retries it with the same headers)."""
+    hook_uuid = headers.get("X-Hook-UUID")
+    request_uuid = headers.get("X-Request-UUID")
+    if not request_uuid:
+        return None
+    return f"{hook_uuid}/{request_uuid}"
+
+
+class Deliveries:
+    """The deliveries received within the last `window` seconds (at most `maxsize`
+    of them, the oldest are forgotten first), to drop those Bitbucket retries."""
+
+    def __init__(
+        self,
+        window: float = WEBHOOKS_DEDUPE_WINDOW,
+        maxsize: int = WEBHOOKS_DEDUPE_SIZE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.window = window
+        self.maxsize = maxsize
+        self.clock = clock
+        # delivery key: when it was received, oldest first
+        self._received: OrderedDict[str, float] = OrderedDict()
+        self.duplicates = 0
+
+    def seen(self, key: str) -> bool:
+        """Whether the delivery was already received; if not, it is now."""
+        now = self.clock()
+        received_at = self._received.get(key)
+        if received_at is not None and now - received_at <= self.window:
+            self.duplicates += 1
+            return True
+        self.add(key, now)
+        return False
+
+    def add(self, key: str, received_at: float) -> None:
+        self._received[key] = received_at
+        self._received.move_to_end(key)
+        self._expire()
+
+    def forget(self, key: str) -> None:
+        """Forget a delivery (eg: refused, so it'll be retried)."""
+        self._received.pop(key, None)
+
+    def _expire(self) -> None:
+        expired = self.clock() - self.window
+        while self._received:
+            received_at = next(iter(self._received.values()))
+            if len(self._received) <= self.maxsize and received_at >= expired:
+                return
+            self._received.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._received), "duplicates": self.duplicates}
+
+
+deliveries = Deliveries()
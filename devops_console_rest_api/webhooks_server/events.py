@@ -0,0 +1,90 @@
+from functools import cached_property
+from typing import Any, Dict, List, Type
+
+import orjson
+from pydantic import BaseModel
+
+from ..models.webhooks import (
+    PRApprovedEvent,
+    PRCreatedEvent,
+    PRDeclinedEvent,
+    PRMergedEvent,
+    PRUpdatedEvent,
+    RepoBuildStatusCreated,
+    RepoBuildStatusUpdated,
+    RepoPushEvent,
+    WebhookEventKey,
+)
+
+# the model of each supported event
+MODELS: Dict[str, Type[BaseModel]] = {
+    WebhookEventKey.repo_push: RepoPushEvent,
+    WebhookEventKey.repo_build_created: RepoBuildStatusCreated,
+    WebhookEventKey.repo_build_updated: RepoBuildStatusUpdated,
+    WebhookEventKey.pr_created: PRCreatedEvent,
+    WebhookEventKey.pr_updated: PRUpdatedEvent,
+    WebhookEventKey.pr_approved: PRApprovedEvent,
+    WebhookEventKey.pr_declined: PRDeclinedEvent,
+    WebhookEventKey.pr_merged: PRMergedEvent,
+}
+
+
+def _get(payload: Any, *path: str) -> Any:
+    for name in path:
+        if not isinstance(payload, dict):
+            return None
+        payload = payload.get(name)
+    return payload
+
+
+class Event:
+    """A received webhook event, parsed in two phases.
+
+    The payload is only decoded (with orjson): the fields used for routing are read
+    from it as is. The pydantic model, whose validation costs much more than the
+    decoding, is only built if a handler needs it (see `model`).
+    """
+
+    def __init__(self, key: str, payload: Dict[str, Any]):
+        self.key = key
+        self.payload = payload
+
+    @classmethod
+    def parse(cls, key: str, body: bytes) -> "Event":
+        payload = orjson.loads(body)
+        if type(payload) is not dict:
+            raise ValueError(f"Invalid JSON: {payload}")
+        return cls(key, payload)
+
+    @property
+    def repository_uuid(self) -> str | None:
+        return _get(self.payload, "repository", "uuid")
+
+    @property
+    def branches(self) -> List[str]:
+        """The branches updated by a push."""
+        return [
+            _get(change, "new", "name")
+            for change in _get(self.payload, "push", "changes") or []
+            if _get(change, "new", "type") == "branch"
+        ]
+
+    @property
+    def commit(self) -> str | None:
+        """The commit of a commit status."""
+        return _get(self.payload, "commit_status", "commit", "hash")
+
+    @property
+    def status_key(self) -> str | None:
+        """What a commit status is for (eg: a build), a commit can have several."""
+        return _get(self.payload, "commit_status", "key")
+
+    @property
+    def updated_on(self) -> str | None:
+        """When a commit status was updated (ISO 8601)."""
+        return _get(self.payload, "commit_status", "updated_on")
+
+    @cached_property
+    def model(self) -> BaseModel:
+        """The validated event (eg: a RepoPushEvent)."""
+        return MODELS[self.key](**self.payload)
@@ -0,0 +1,306 @@
+"""Append-only journal of the received webhook events.
+
+Events are appended to the current segment file, named after the offset of its
+first event; the segment is rotated once it reaches `segment_size` bytes. Each
+record is a JSON header line (offset, reception time, event key, delivery key,
+body size) followed by the raw body and a newline.
+
+An event is acknowledged only once it's synced to disk. Concurrent appends wait
+for the same fsync (group commit). The offset of the last event handled with
+every previous event handled too (the "committed" offset) is written alongside
+the segments: after a restart, the events past it are handled again.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Set, Tuple
+
+import orjson
+
+from ..config import (
+    WEBHOOKS_JOURNAL_DIR,
+    WEBHOOKS_JOURNAL_FSYNC_DELAY,
+    WEBHOOKS_JOURNAL_RETENTION,
+    WEBHOOKS_JOURNAL_SEGMENT_SIZE,
+)
+
+SEGMENT_SUFFIX = ".log"
+COMMITTED_FILE = "committed"
+
+# the committed offset is written at most once per COMMIT_INTERVAL seconds: after a
+# crash, the events handled in the meantime are handled again
+COMMIT_INTERVAL = 1.0
+
+
+class Record(NamedTuple):
+    offset: int
+    # time.time() when received
+    received_at: float
+    event_key: str
+    body: bytes
+    # see deliveries.delivery_key
+    delivery: str | None = None
+
+
+def _records(file: str) -> Iterator[Tuple[Record, int]]:
+    """The records of a segment, with the position after each of them.
+
+    Stops at the first incomplete record (eg: the process died writing it).
+    """
+    with open(file, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                return
+            try:
+                header = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                logging.warning(f"Corrupted journal segment {file} at {f.tell()}")
+                return
+            body = f.read(header["size"] + 1)
+            if len(body) != header["size"] + 1:
+                return
+            record = Record(
+                header["offset"],
+                header["received_at"],
+                header["event_key"],
+                body[:-1],
+                header.get("delivery"),
+            )
+            yield record, f.tell()
+
+
+def _sync(fd: int) -> None:
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    def __init__(
+        self,
+        path: str,
+        segment_size: int = WEBHOOKS_JOURNAL_SEGMENT_SIZE,
+        retention: float = WEBHOOKS_JOURNAL_RETENTION,
+        fsync_delay: float = WEBHOOKS_JOURNAL_FSYNC_DELAY,
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.retention = retention
+        self.fsync_delay = fsync_delay
+
+        self.next_offset = 0
+        self.committed = -1
+        # appended but not handled yet
+        self._pending: Set[int] = set()
+        self._file: IO[bytes] | None = None
+        self._opened = False
+        self._committed_at = 0.0
+
+        # appends waiting for the next fsync
+        self._waiters: List[asyncio.Future] = []
+        self._flushing: asyncio.Task | None = None
+
+        self.appended = 0
+        self.syncs = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        """(first offset, file) of each segment, in order."""
+        segments = []
+        for name in os.listdir(self.path):
+            if name.endswith(SEGMENT_SUFFIX):
+                first = int(name[: -len(SEGMENT_SUFFIX)])
+                segments.append((first, os.path.join(self.path, name)))
+        return sorted(segments)
+
+    def _segment_file(self, first_offset: int) -> str:
+        return os.path.join(self.path, f"{first_offset:020d}{SEGMENT_SUFFIX}")
+
+    def open(self) -> None:
+        """Find where the last run stopped (once).
+
+        The events past the committed offset are pending: see backlog().
+        """
+        if self._opened or not self.enabled:
+            return
+        self._opened = True
+        os.makedirs(self.path, exist_ok=True)
+
+        try:
+            with open(os.path.join(self.path, COMMITTED_FILE), "rb") as f:
+                self.committed = orjson.loads(f.read())["committed"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Ignoring invalid committed journal offset: {e}")
+
+        segments = self._segments()
+        if segments:
+            first, file = segments[-1]
+            self.next_offset, end = first, 0
+            for record, end in _records(file):
+                self.next_offset = record.offset + 1
+            if end < os.path.getsize(file):
+                logging.warning(f"Truncating incomplete journal record in {file}")
+                os.truncate(file, end)
+
+        self.committed = min(self.committed, self.next_offset - 1)
+        self._pending = set(range(self.committed + 1, self.next_offset))
+        self._file = open(self._segment_file(self.next_offset), "ab")
+
+    def backlog(self) -> Iterator[Record]:
+        """The events not handled by the last run."""
+        return self.read(after=self.committed)
+
+    def read(
+        self,
+        after: int = -1,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> Iterator[Record]:
+        """The events past the offset `after`, received between `since` and `until`
+        (timestamps) if given."""
+        if not self.enabled:
+            return
+        self.open()
+        self._file.flush()
+
+        segments = self._segments()
+        for i, (first, file) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= after + 1:
+                continue  # every event of the segment is at or before `after`
+            # the segment was last written before `since` (modification times
+            # can lag behind time.time() a little)
+            if since is not None and os.path.getmtime(file) < since - 1:
+                continue
+            for record, _ in _records(file):
+                if record.offset <= after:
+                    continue
+                if since is not None and record.received_at < since:
+                    continue
+                if until is not None and record.received_at > until:
+                    return
+                yield record
+
+    async def append(
+        self, event_key: str, body: bytes, delivery: str | None = None
+    ) -> int | None:
+        """Write an event and wait for it to be on disk; return its offset."""
+        if not self.enabled:
+            return None
+        self.open()
+
+        if self._file.tell() >= self.segment_size:
+            self._rotate()
+
+        offset = self.next_offset
+        self.next_offset += 1
+        header = orjson.dumps(
+            {
+                "offset": offset,
+                "received_at": time.time(),
+                "event_key": event_key,
+                "delivery": delivery,
+                "size": len(body),
+            }
+        )
+        self._file.write(header + b"\n" + body + b"\n")
+        self._pending.add(offset)
+        self.appended += 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush())
+        try:
+            await waiter
+        except BaseException:
+            # not acknowledged: it'll be delivered again, don't hold the committed
+            # offset back waiting for it to be handled
+            self.done(offset)
+            raise
+        return offset
+
+    async def _flush(self) -> None:
+        # let the events received in the meantime share the fsync
+        await asyncio.sleep(self.fsync_delay)
+        waiters, self._waiters = self._waiters, []
+        self._flushing = None
+
+        try:
+            self._file.flush()
+            # on a duplicate of the descriptor, in case the segment is rotated
+            await asyncio.to_thread(_sync, os.dup(self._file.fileno()))
+        except Exception as e:
+            logging.error(f"Failed to sync the webhook events journal: {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self.syncs += 1
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _rotate(self) -> None:
+        # the events of the segment may be waiting for the next fsync: sync them
+        # now (rotations are rare enough to block for it)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = open(self._segment_file(self.next_offset), "ab")
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        """Delete the segments older than the retention, once handled."""
+        expired = time.time() - self.retention
+        segments = self._segments()
+        for (_, file), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 > self.committed:
+                break
+            if os.path.getmtime(file) < expired:
+                os.remove(file)
+
+    def done(self, offset: int) -> None:
+        """Record that an event was handled."""
+        self._pending.discard(offset)
+        committed = min(self._pending) - 1 if self._pending else self.next_offset - 1
+        if committed == self.committed:
+            return
+        self.committed = committed
+
+        now = time.monotonic()
+        if now - self._committed_at >= COMMIT_INTERVAL:
+            self._committed_at = now
+            self.save_committed()
+
+    def save_committed(self) -> None:
+        if not self.enabled:
+            return
+        file = os.path.join(self.path, COMMITTED_FILE)
+        with open(f"{file}.tmp", "wb") as f:
+            f.write(orjson.dumps({"committed": self.committed}))
+        os.replace(f"{file}.tmp", file)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "next_offset": self.next_offset,
+            "committed": self.committed,
+            "backlog": len(self._pending),
+            "appended": self.appended,
+            "syncs": self.syncs,
+            # events per fsync
+            "batch": self.appended / self.syncs if self.syncs else 0,
+        }
+
+
+journal = Journal(WEBHOOKS_JOURNAL_DIR)
@@ -0,0 +1,100 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from ..config import WEBHOOKS_HANDLER_TIMEOUT
+from ..metrics import Histogram
+from .events import Event
+
+# a handler takes the event as the `event` keyword argument; it may be async
+Handler = Callable[..., Any]
+
+
+class Registration(NamedTuple):
+    name: str
+    handler: Handler
+    timeout: float
+
+
+class HandlerMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.failures = 0
+        self.timeouts = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency.snapshot(),
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+        }
+
+
+class HandlerRegistry:
+    """The handlers of each kind of webhook event.
+
+    Several independent handlers (eg: cache invalidation, notifications) can
+    handle the same kind of event: they run concurrently, each within its own
+    timeout, and one failing or timing out doesn't affect the others.
+    """
+
+    def __init__(self, timeout: float = WEBHOOKS_HANDLER_TIMEOUT):
+        self.timeout = timeout
+        self._handlers: Dict[str, List[Registration]] = {}
+        self._metrics: Dict[str, HandlerMetrics] = {}
+
+    def register(
+        self, *event_keys: str, timeout: float | None = None
+    ) -> Callable[[Handler], Handler]:
+        """Decorator registering a handler of the events with these keys."""
+
+        def decorator(handler: Handler) -> Handler:
+            name = f"{handler.__module__}.{handler.__qualname__}"
+            registration = Registration(name, handler, timeout or self.timeout)
+            for event_key in event_keys:
+                self._handlers.setdefault(event_key, []).append(registration)
+            self._metrics.setdefault(name, HandlerMetrics())
+            return handler
+
+        return decorator
+
+    def __contains__(self, event_key: str) -> bool:
+        return bool(self._handlers.get(event_key))
+
+    async def dispatch(self, event: Event) -> None:
+        """Run the handlers of the event (concurrently)."""
+        await asyncio.gather(
+            *[
+                self._run(registration, event)
+                for registration in self._handlers[event.key]
+            ]
+        )
+
+    async def _run(self, registration: Registration, event: Event) -> None:
+        metrics = self._metrics[registration.name]
+        start = time.perf_counter()
+        try:
+            result = registration.handler(event=event)
+            if inspect.isawaitable(result):
+                await asyncio.wait_for(result, registration.timeout)
+        except asyncio.TimeoutError:
+            metrics.timeouts += 1
+            logging.error(
+                f'{registration.name} timed out handling "{event.key}" event'
+                f" (after {registration.timeout}s)"
+            )
+        except Exception:
+            metrics.failures += 1
+            logging.exception(
+                f'{registration.name} failed to handle "{event.key}" event'
+            )
+        finally:
+            metrics.latency.observe(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: metrics.snapshot() for name, metrics in self._metrics.items()}
+
+
+handlers = HandlerRegistry()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from ..config import WEBHOOKS_QUEUE_SIZE, WEBHOOKS_WORKERS
+from ..metrics import Histogram
+
+# how a worker handles an event: (event key, raw body); may return a future, if
+# the event is only done being handled once it completes
+Handler = Callable[[str, bytes], Awaitable[Any]]
+
+# event key, raw body, time.monotonic() when received, journal offset
+Item = Tuple[str, bytes, float, int | None]
+
+
+class WorkQueue:
+    """Bounded queue of received webhook events, handled by a pool of workers.
+
+    Receiving an event only queues it, so the endpoint answers Bitbucket right
+    away however long handling it takes. The workers are started by `start`, on
+    startup (see recover_webhook_events).
+
+    `done` is called with the journal offset of each event handled (or failed).
+    """
+
+    def __init__(
+        self,
+        handle: Handler,
+        maxsize: int = WEBHOOKS_QUEUE_SIZE,
+        workers: int = WEBHOOKS_WORKERS,
+        done: Callable[[int], None] | None = None,
+    ):
+        if maxsize < 1 or workers < 1:
+            raise ValueError("maxsize and workers must be positive")
+        self.handle = handle
+        self.maxsize = maxsize
+        self.workers = workers
+        self.done = done
+
+        self._queue: asyncio.Queue[Item] = asyncio.Queue(maxsize)
+        self._workers: List[asyncio.Task] = []
+        self._busy = 0
+
+        # time between an event being received and a worker picking it up
+        self.wait = Histogram()
+        # time spent handling an event
+        self.handling = Histogram()
+        # how long the last event picked up waited
+        self.lag = 0.0
+        self.received = 0
+        self.refused = 0
+        self.handled = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Start the workers on the running loop."""
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def put(self, event_key: str, body: bytes, offset: int | None = None) -> bool:
+        """Queue an event; return False if the queue is full."""
+        try:
+            self._queue.put_nowait((event_key, body, time.monotonic(), offset))
+        except asyncio.QueueFull:
+            self.refused += 1
+            return False
+        self.received += 1
+        return True
+
+    async def put_wait(
+        self, event_key: str, body: bytes, offset: int | None = None
+    ) -> None:
+        """Queue an event, waiting for room if the queue is full (eg: a replay)."""
+        await self._queue.put((event_key, body, time.monotonic(), offset))
+        self.received += 1
+
+    async def _work(self) -> None:
+        while True:
+            event_key, body, received_at, offset = await self._queue.get()
+            started_at = time.monotonic()
+            self.lag = started_at - received_at
+            self.wait.observe(self.lag)
+            self._busy += 1
+            completion = None
+            try:
+                completion = await self.handle(event_key, body)
+            except Exception:
+                logging.exception(f'Failed to handle webhook event "{event_key}"')
+                self.failed += 1
+            else:
+                self.handled += 1
+            finally:
+                self._busy -= 1
+                self._finish(offset, completion)
+                self.handling.observe(time.monotonic() - started_at)
+                self._queue.task_done()
+
+    def _finish(self, offset: int | None, completion: Any) -> None:
+        if offset is None or self.done is None:
+            return
+        if isinstance(completion, asyncio.Future):
+            # eg: held back to be coalesced; the worker moves on in the meantime
+            completion.add_done_callback(lambda _: self.done(offset))
+        else:
+            self.done(offset)
+
+    async def join(self) -> None:
+        """Wait until every queued event is handled."""
+        await self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self._queue.qsize(),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "busy": self._busy,
+            "lag": self.lag,
+            "received": self.received,
+            "refused": self.refused,
+            "handled": self.handled,
+            "failed": self.failed,
+            "wait": self.wait.snapshot(),
+            "handling": self.handling.snapshot(),
+        }
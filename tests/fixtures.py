@@ -1,4 +1,7 @@
+import asyncio
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import threading
 import types
 from uuid import uuid4
 from devops_sccs.atscached import atscached
@@ -128,6 +131,24 @@ mock_project = {
     "key": "test",
 }
 
+mock_repository = {
+    "links": {},
+    "uuid": uuid4().hex,
+    "full_name": "test/test",
+    "is_private": True,
+    "owner": mock_account,
+    "name": "test",
+    "created_on": str(datetime.now() + timedelta(days=-30)),
+    "updated_on": str(datetime.now()),
+    "size": 1024,
+    "language": "python",
+    "has_issues": False,
+    "has_wiki": False,
+    "fork_policy": "no_forks",
+    "project": mock_project,
+    "mainbranch": mock_referencestate,
+}
+
 mock_projectvalue = {
     "name": "test",
     "key": "test",
@@ -170,7 +191,7 @@ def mock_bitbucket_client(monkeypatch):
 
     @atscached()
     async def get_repositories():
-        return ["mock success"]
+        return [mock_repository]
 
     monkeypatch.setattr(
         bitbucket_client, "get_repositories", get_repositories, raising=False
@@ -234,3 +255,113 @@ def mock_bitbucket_client(monkeypatch):
     monkeypatch.setattr(
         bitbucket_client, "cd_branches_accepted", ["test"], raising=False
     )
+
+    # start every test with cold caches, and no refresh left running by the event
+    # loop of another test (the listeners wired at import time are kept)
+    from devops_console_rest_api import cache
+
+    fresh_caches = [(cache.repository_cache, cache.RepositoryCache())]
+    for listing_cache in (cache.repositories_cache, cache.projects_cache):
+        fresh = cache.ListingCache(listing_cache.model, listing_cache.fetch)
+        fresh_caches.append((listing_cache, fresh))
+    for current, fresh in fresh_caches:
+        for name, value in vars(fresh).items():
+            if name != "listeners":
+                monkeypatch.setattr(current, name, value)
+
+    from devops_console_rest_api.jobs import job_manager
+    from devops_console_rest_api.search import RepositorySearchIndex, repository_search
+
+    for name, value in vars(RepositorySearchIndex()).items():
+        monkeypatch.setattr(repository_search, name, value)
+
+    # keep jobs, webhook subscription states and deliveries in memory, don't journal
+    # events
+    from devops_console_rest_api import default_webhooks
+    from devops_console_rest_api.webhooks_server import app as webhooks_app
+    from devops_console_rest_api.webhooks_server.deliveries import Deliveries
+    from devops_console_rest_api.webhooks_server.journal import Journal
+    from devops_console_rest_api.webhooks_server.work_queue import WorkQueue
+
+    monkeypatch.setattr(job_manager, "path", "")
+    monkeypatch.setattr(job_manager, "jobs", {})
+    monkeypatch.setattr(
+        default_webhooks, "subscription_states", default_webhooks.SubscriptionStates("")
+    )
+    monkeypatch.setattr(webhooks_app, "journal", Journal(""))
+    monkeypatch.setattr(webhooks_app, "deliveries", Deliveries())
+    # not started: tests start a queue on their own event loop to handle its events
+    monkeypatch.setattr(
+        webhooks_app,
+        "work_queue",
+        WorkQueue(
+            webhooks_app.process_webhook_event,
+            done=lambda offset: webhooks_app.journal.done(offset),
+        ),
+    )
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Mock core sccs, bridged through setup_bb_client
+# ----------------------------------------------------------------------------------------------------------------------
+
+mock_config = {
+    "vault_bitbucket": {
+        "username": "test",
+        "email": "test@test.com",
+        "app_passwords": {"bitbucket_management": "test"},
+    },
+}
+
+
+class MockCoreSccs:
+    """Stand-in for the core sccs; every call takes `delay` seconds on the core loop."""
+
+    delay = 0.2
+    cd_branches_accepted = ["test"]
+
+    async def get_repositories(self, plugin_id, session, args=None):
+        await asyncio.sleep(self.delay)
+        return [mock_repository]
+
+    async def get_repository(self, plugin_id, session, repository=None, args=None):
+        await asyncio.sleep(self.delay)
+        if repository == "nonexisting":
+            raise LookupError(repository)
+        return mock_repository
+
+    async def get_projects(self, plugin_id, session, args=None):
+        await asyncio.sleep(self.delay)
+        return [mock_project]
+
+
+@contextmanager
+def bridge(core_sccs):
+    """Run `core_sccs` on its own event loop thread, like devops-console does."""
+    from devops_console_rest_api.client import bitbucket_client, setup_bb_client
+
+    saved = dict(vars(bitbucket_client))
+    bitbucket_client.__init__()  # fresh counters
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    setup_bb_client(config=mock_config, core_sccs=core_sccs, loop=loop)
+
+    try:
+        yield core_sccs
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+        vars(bitbucket_client).clear()
+        vars(bitbucket_client).update(saved)
+
+
+@pytest.fixture
+def bridged_bitbucket_client():
+    """A MockCoreSccs bridged through setup_bb_client."""
+    with bridge(MockCoreSccs()) as core_sccs:
+        yield core_sccs
@@ -0,0 +1,125 @@
+import asyncio
+from uuid import uuid4
+
+from devops_console_rest_api.cache import ListingCache, RepositoryCache
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.models.bitbucket import Project, Repository
+from devops_console_rest_api.snapshot import CatalogSnapshot
+
+from .fixtures import MockCoreSccs, bridge, mock_project, mock_repository
+
+
+class CachingCoreSccs(MockCoreSccs):
+    """Caches get_repository, like the core sccs does (see atscached)."""
+
+    delay = 0
+
+    def __init__(self):
+        # what Bitbucket has
+        self._repositories = {
+            "test": mock_repository,
+            "other": {**mock_repository, "name": "other", "uuid": str(uuid4())},
+        }
+        cache = {}
+
+        async def fetch(plugin_id, session, repository=None, args=None):
+            return self._repositories[repository]
+
+        async def get_repository(plugin_id, session, repository=None, args=None):
+            if repository not in cache:
+                cache[repository] = await fetch(plugin_id, session, repository)
+            return cache[repository]
+
+        get_repository.__wrapped__ = fetch
+        self.get_repository = get_repository
+
+
+def test_listing_cache_serves_stale_while_revalidating():
+    fetched = []
+
+    async def fetch():
+        fetched.append(None)
+        await asyncio.sleep(0.05)
+        return {"values": [{"key": f"P{len(fetched)}"}]}
+
+    cache = ListingCache(Project, fetch, ttl=0.1, max_staleness=0.3)
+
+    async def scenario():
+        # cold: concurrent readers share a single fetch
+        listings = await asyncio.gather(*[cache.get() for _ in range(5)])
+        assert {listing.values[0].key for listing in listings} == {"P1"}
+        assert len(fetched) == 1
+
+        # stale: served right away, refreshed in the background
+        await asyncio.sleep(0.15)
+        assert (await cache.get()).values[0].key == "P1"
+        await asyncio.sleep(0.1)
+        assert (await cache.get()).values[0].key == "P2"
+
+        # too stale: readers wait for fresh data
+        await asyncio.sleep(0.35)
+        assert (await cache.get()).values[0].key == "P3"
+
+    asyncio.run(scenario())
+
+    stats = cache.stats()
+    assert stats["refreshes"] == 3
+    assert stats["stale_hits"] == 1
+    assert stats["version"] == 3
+
+
+def test_repository_refresh_skips_the_core_cache():
+    core_sccs = CachingCoreSccs()
+
+    async def push():
+        cache = RepositoryCache()
+        before = await cache.get(name="test")
+        await bitbucket_client.get_repository(repository="other")
+        for name in ("test", "other"):
+            core_sccs._repositories[name] = {
+                **core_sccs._repositories[name],
+                "size": 0,
+            }
+        await cache.refresh(before.uuid)
+        # only the pushed repository skipped the core cache
+        still_cached = await bitbucket_client.get_repository(repository="other")
+        return before, cache.lookup(name="test"), still_cached
+
+    with bridge(core_sccs):
+        before, after, still_cached = asyncio.run(push())
+
+    assert before.size == mock_repository["size"]
+    assert after.size == 0
+    assert still_cached["size"] == mock_repository["size"]
+
+
+def test_catalog_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+
+    async def fetch_repositories():
+        return [mock_repository]
+
+    async def fetch_projects():
+        return [mock_project]
+
+    repositories = ListingCache(Repository, fetch_repositories)
+    projects = ListingCache(Project, fetch_projects)
+    snapshot = CatalogSnapshot(
+        path, {"repositories": repositories, "projects": projects}
+    )
+    repositories.set([mock_repository])
+    projects.set([mock_project])  # both listings known: written
+
+    restored = ListingCache(Repository, fetch_repositories)
+    restored_snapshot = CatalogSnapshot(
+        path,
+        {"repositories": restored, "projects": ListingCache(Project, fetch_projects)},
+    )
+    assert restored_snapshot.load()
+    assert restored.listing.etag == repositories.listing.etag
+    # served, but refreshed on first read
+    assert restored.age() >= restored.ttl
+
+    with open(path, "ab") as f:
+        f.write(b"garbage")
+    assert not restored_snapshot.load()
@@ -0,0 +1,149 @@
+import asyncio
+from http import HTTPStatus
+import time
+
+from devops_console_rest_api import client as client_module
+from devops_console_rest_api.client import bitbucket_client as client
+from devops_console_rest_api.ratelimit import RateLimiter
+import pytest
+
+from .fixtures import MockCoreSccs, bridge, bridged_bitbucket_client
+
+
+class RateLimited(Exception):
+    status = HTTPStatus.TOO_MANY_REQUESTS
+
+
+class RateLimitingCoreSccs(MockCoreSccs):
+    """Rate limits the first call for the "limited" repository."""
+
+    limited = False
+
+    async def get_repository(self, plugin_id, session, repository=None, args=None):
+        if repository == "limited" and not self.limited:
+            self.limited = True
+            raise RateLimited()
+        return await super().get_repository(plugin_id, session, repository, args)
+
+
+def test_identical_calls_are_coalesced(bridged_bitbucket_client):
+    async def get_all():
+        return await asyncio.gather(
+            *[client.get_repositories() for _ in range(5)],
+            *[client.get_repository(repository="test") for _ in range(3)],
+        )
+
+    results = asyncio.run(get_all())
+
+    assert len(results) == 8
+    stats = client.stats()["coalescing"]
+    assert stats["get_repositories"] == {"calls": 5, "upstream": 1, "coalesced": 4}
+    assert stats["get_repository"] == {"calls": 3, "upstream": 1, "coalesced": 2}
+
+
+def test_map_runs_batch_with_bounded_concurrency(bridged_bitbucket_client):
+    names = [f"repo-{i}" for i in range(9)] + ["nonexisting"]
+
+    async def get_all():
+        start = time.perf_counter()
+        outcomes = [
+            outcome
+            async for outcome in client.map(
+                "get_repository",
+                [{"repository": name} for name in names],
+                concurrency=5,
+            )
+        ]
+        return outcomes, time.perf_counter() - start
+
+    outcomes, elapsed = asyncio.run(get_all())
+
+    assert sorted(kwargs["repository"] for kwargs, _ in outcomes) == sorted(names)
+    errors = [kwargs for kwargs, outcome in outcomes if isinstance(outcome, Exception)]
+    assert errors == [{"repository": "nonexisting"}]
+    # 10 calls, 5 at a time
+    delay = bridged_bitbucket_client.delay
+    assert 2 * delay <= elapsed < 3 * delay
+
+
+def test_map_fails_the_calls_of_a_failed_batch(bridged_bitbucket_client, monkeypatch):
+    async def failing_batch(f, calls, concurrency, emit, *args):
+        emit((calls[0], "done"))
+        raise RuntimeError("core sccs stopped")
+
+    monkeypatch.setattr(client_module, "_run_batch", failing_batch)
+    calls = [{"repository": name} for name in ("a", "b", "c")]
+
+    async def get_all():
+        return [outcome async for outcome in client.map("get_repository", calls)]
+
+    # the calls left aren't waited for forever
+    outcomes = asyncio.run(asyncio.wait_for(get_all(), 1))
+
+    assert outcomes[0] == (calls[0], "done")
+    assert [kwargs for kwargs, _ in outcomes[1:]] == calls[1:]
+    assert all(isinstance(outcome, RuntimeError) for _, outcome in outcomes[1:])
+
+
+def test_bridged_calls_are_instrumented(bridged_bitbucket_client):
+    async def get_all():
+        await asyncio.gather(*[client.get_repository(repository=i) for i in range(3)])
+
+    asyncio.run(get_all())
+
+    metrics = client.stats()["bridge"]["get_repository"]
+    assert metrics["queued"]["count"] == 3
+    assert metrics["execution"]["count"] == 3
+    assert metrics["execution"]["sum"] >= 3 * bridged_bitbucket_client.delay
+    assert metrics["in_flight"]["max"] == 3
+    assert metrics["current_in_flight"] == 0
+    assert metrics["timeouts"] == 0
+
+
+def test_batched_calls_are_instrumented_once():
+    names = ["limited", "a", "b", "c"]
+    limiter = RateLimiter(100, 1, backoff=0.01)
+
+    async def get_all():
+        async for _ in client.map(
+            "get_repository",
+            [{"repository": name} for name in names],
+            concurrency=2,
+            limiter=limiter,
+        ):
+            pass
+
+    with bridge(RateLimitingCoreSccs()) as core_sccs:
+        asyncio.run(get_all())
+        metrics = client.stats()["bridge"]["get_repository"]
+
+    assert limiter.stats()["rate_limited"] == 1
+    # once per call, the retry included
+    for histogram in ("queued", "waiting", "execution"):
+        assert metrics[histogram]["count"] == len(names)
+    # the calls waiting for a concurrency slot aren't queued
+    assert metrics["queued"]["max"] < core_sccs.delay
+    assert metrics["waiting"]["sum"] >= 2 * core_sccs.delay
+    assert metrics["execution"]["sum"] >= len(names) * core_sccs.delay
+    assert metrics["current_in_flight"] == 0
+
+
+def test_calls_failing_to_be_submitted_are_not_in_flight(
+    bridged_bitbucket_client, monkeypatch
+):
+    def closed(coro, loop):
+        coro.close()
+        raise RuntimeError("Event loop is closed")
+
+    monkeypatch.setattr(client_module.asyncio, "run_coroutine_threadsafe", closed)
+
+    async def get_all():
+        with pytest.raises(RuntimeError):
+            await client.get_repository(repository="test")
+        with pytest.raises(RuntimeError):
+            async for _ in client.map("get_repository", [{"repository": "test"}]):
+                pass
+
+    asyncio.run(get_all())
+
+    assert client.stats()["bridge"]["get_repository"]["current_in_flight"] == 0
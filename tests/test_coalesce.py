@@ -0,0 +1,124 @@
+import asyncio
+import random
+
+from devops_console_rest_api.webhooks_server.coalesce import Coalescer
+from devops_console_rest_api.webhooks_server.events import Event
+from devops_console_rest_api.webhooks_server.work_queue import WorkQueue
+
+
+def commit_status(commit, minute, key="build"):
+    return Event(
+        "repo:commit_status_updated",
+        {
+            "repository": {"uuid": "{repo}"},
+            "commit_status": {
+                "key": key,
+                "commit": {"hash": commit},
+                "updated_on": f"2022-06-01T12:{minute:02d}:00+00:00",
+            },
+        },
+    )
+
+
+def push(branch, n):
+    return Event(
+        "repo:push",
+        {
+            "repository": {"uuid": "{repo}"},
+            "push": {"changes": [{"new": {"type": "branch", "name": branch}}]},
+            "n": n,
+        },
+    )
+
+
+def test_bursts_are_coalesced():
+    dispatched = []
+
+    async def dispatch(event):
+        dispatched.append(event)
+
+    statuses = [commit_status("abc", minute) for minute in range(20)]
+    random.Random(1).shuffle(statuses)  # not necessarily delivered in order
+    events = [
+        *statuses,
+        commit_status("abc", 5, key="deploy"),
+        commit_status("def", 1),
+        *[push("master", n) for n in range(10)],
+        Event("pullrequest:created", {"repository": {"uuid": "{repo}"}}),
+    ]
+
+    async def run():
+        coalescer = Coalescer(dispatch, window=0.05)
+        held = [await coalescer.handle(event) for event in events]
+        # only the pull request isn't held back
+        assert [event.key for event in dispatched] == ["pullrequest:created"]
+        assert held[-1] is None
+
+        await asyncio.gather(*held[:-1])
+        return coalescer.stats()
+
+    stats = asyncio.run(run())
+
+    # the newest state of each commit status, and the last push
+    assert [
+        (event.commit, event.status_key, event.updated_on[11:16])
+        for event in dispatched
+        if event.commit
+    ] == [
+        ("abc", "build", "12:19"),
+        ("abc", "deploy", "12:05"),
+        ("def", "build", "12:01"),
+    ]
+    assert [event.payload["n"] for event in dispatched if event.branches] == [9]
+
+    assert stats["received"] == 32
+    assert stats["dispatched"] == 4
+    assert stats["collapsed"] == 28
+    assert stats["collapse_ratio"] == 28 / 32
+
+
+def test_bursts_longer_than_the_window():
+    dispatched = []
+
+    async def dispatch(event):
+        dispatched.append(event.payload["n"])
+
+    async def burst(coalescer, events, interval):
+        held = []
+        for n in range(events):
+            held.append(await coalescer.handle(push("master", n)))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*held)
+
+    # a push every 20 ms for 200 ms: handled once, after the burst
+    asyncio.run(burst(Coalescer(dispatch, window=0.1, max_wait=1), 10, 0.02))
+    assert dispatched == [9]
+
+    # ...unless it lasts longer than max_wait
+    dispatched.clear()
+    asyncio.run(burst(Coalescer(dispatch, window=0.1, max_wait=0.1), 10, 0.02))
+    assert 2 <= len(dispatched) <= 4
+    assert dispatched[-1] == 9
+
+
+def test_held_events_are_done_once_handled():
+    done = []
+
+    async def run():
+        held = asyncio.get_running_loop().create_future()
+
+        async def handle(event_key, body):
+            return held
+
+        queue = WorkQueue(handle, done=done.append)
+        queue.start()
+        queue.put("repo:push", b"{}", offset=7)
+        await queue.join()
+        # the worker moved on, but the event isn't handled yet
+        assert done == []
+
+        held.set_result(None)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert done == [7]
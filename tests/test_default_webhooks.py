@@ -0,0 +1,187 @@
+import asyncio
+from uuid import uuid4
+
+from devops_console_rest_api import default_webhooks
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.config import (
+    WEBHOOKS_DEFAULT_DESCRIPTION,
+    WEBHOOKS_DEFAULT_EVENTS,
+    WEBHOOKS_URL,
+)
+from devops_console_rest_api.default_webhooks import plan
+from devops_console_rest_api.jobs import JobManager
+from devops_console_rest_api.models.jobs import Job
+from devops_console_rest_api.ratelimit import RateLimiter
+
+from .fixtures import mock_bitbucket_client, mock_repository
+
+EVENTS = sorted(event.value for event in WEBHOOKS_DEFAULT_EVENTS)
+
+
+def subscription(url=WEBHOOKS_URL, events=EVENTS, **kwargs):
+    return {
+        "uuid": uuid4().hex,
+        "url": url,
+        "events": list(events),
+        "active": True,
+        "description": WEBHOOKS_DEFAULT_DESCRIPTION,
+        **kwargs,
+    }
+
+
+def kinds(actions):
+    return [(action.kind, action.subscription_id) for action in actions]
+
+
+def test_plan():
+    ok = subscription()
+    partial = subscription(events=EVENTS[:2])
+    stale = subscription(url="https://old.example.com/hooks")
+    other = subscription(url="https://ci.example.com", description="CI")
+
+    assert plan("repo", [ok, other], subscribed=True) == []
+    assert kinds(plan("repo", [other], subscribed=True)) == [("create", None)]
+
+    # missing events: update rather than adding a duplicate
+    (update,) = plan("repo", [partial], subscribed=True)
+    assert (update.kind, update.subscription_id, update.events) == (
+        "update",
+        partial["uuid"],
+        EVENTS,
+    )
+    assert kinds(plan("repo", [partial], subscribed=True, can_update=False)) == [
+        ("delete", partial["uuid"]),
+        ("create", None),
+    ]
+
+    # duplicates and stale URLs are deleted
+    assert kinds(plan("repo", [partial, ok, stale], subscribed=True)) == [
+        ("delete", stale["uuid"]),
+        ("delete", partial["uuid"]),
+    ]
+    assert kinds(plan("repo", [ok, stale, other], subscribed=False)) == [
+        ("delete", stale["uuid"]),
+        ("delete", ok["uuid"]),
+    ]
+
+
+def test_reconcile_uses_the_last_known_state(mock_bitbucket_client, monkeypatch):
+    subscriptions = {
+        "up-to-date": [subscription()],
+        "missing": [],
+        "partial": [subscription(events=EVENTS[:1])],
+    }
+    calls = []
+
+    async def get_repositories():
+        return [
+            {**mock_repository, "uuid": uuid4().hex, "name": name}
+            for name in subscriptions
+        ]
+
+    async def get_webhook_subscriptions(repo_name):
+        calls.append(("get", repo_name))
+        return {"values": subscriptions[repo_name]}
+
+    async def create_webhook_subscription(repo_name, **kwargs):
+        calls.append(("create", repo_name))
+        subscriptions[repo_name].append(subscription(events=kwargs["events"]))
+        return subscriptions[repo_name][-1]
+
+    async def update_webhook_subscription(repo_name, subscription_id, **kwargs):
+        calls.append(("update", repo_name))
+        subscriptions[repo_name] = [
+            subscription(uuid=subscription_id, events=kwargs["events"])
+        ]
+        return subscriptions[repo_name][0]
+
+    for f in (
+        get_repositories,
+        get_webhook_subscriptions,
+        create_webhook_subscription,
+        update_webhook_subscription,
+    ):
+        monkeypatch.setattr(bitbucket_client, f.__name__, f, raising=False)
+    monkeypatch.setattr(
+        default_webhooks, "webhooks_rate_limiter", RateLimiter(1000, 3600, burst=100)
+    )
+
+    def run(**params):
+        job = Job(id=uuid4().hex, kind=default_webhooks.SUBSCRIBE, params=params)
+        asyncio.run(default_webhooks.subscribe(job, JobManager("")))
+        return job
+
+    job = run(dry_run=True)
+    assert sorted(calls) == [("get", name) for name in sorted(subscriptions)]
+    assert [(a["kind"], a["repo_name"]) for a in job.result["actions"]] == [
+        ("create", "missing"),
+        ("update", "partial"),
+    ]
+
+    # the subscriptions listed by the dry run are reused
+    calls.clear()
+    job = run()
+    assert sorted(calls) == [("create", "missing"), ("update", "partial")]
+    assert job.summary().done == 3
+
+    # nothing changed: no upstream call at all
+    calls.clear()
+    job = run()
+    assert calls == []
+    assert job.summary().done == 3
+    assert job.result == {"actions": []}
+
+    # listed again, still nothing to do
+    calls.clear()
+    run(refresh=True)
+    assert sorted(calls) == [("get", name) for name in sorted(subscriptions)]
+
+
+def test_reconcile_records_failed_calls_per_repository(
+    mock_bitbucket_client, monkeypatch, tmp_path
+):
+    names = [f"r{i}" for i in range(5)]
+
+    async def get_repositories():
+        return [
+            {**mock_repository, "uuid": uuid4().hex, "name": name} for name in names
+        ]
+
+    async def get_webhook_subscriptions(repo_name):
+        if repo_name == "r2":
+            raise asyncio.TimeoutError()
+        return {"values": [subscription()]}
+
+    for f in (get_repositories, get_webhook_subscriptions):
+        monkeypatch.setattr(bitbucket_client, f.__name__, f, raising=False)
+    monkeypatch.setattr(
+        default_webhooks, "webhooks_rate_limiter", RateLimiter(1000, 3600, burst=100)
+    )
+    states_path = str(tmp_path / "states.json")
+    monkeypatch.setattr(
+        default_webhooks,
+        "subscription_states",
+        default_webhooks.SubscriptionStates(states_path),
+    )
+
+    jobs = JobManager("")
+    jobs.register(default_webhooks.SUBSCRIBE)(default_webhooks.subscribe)
+    job = Job(id=uuid4().hex, kind=default_webhooks.SUBSCRIBE)
+    asyncio.run(jobs._execute(job))
+
+    # the timeout only fails its repository, not the job
+    summary = job.summary()
+    assert (summary.status, summary.error) == ("done", None)
+    assert (summary.done, summary.failed, summary.pending) == (4, 1, 0)
+    assert list(job.errors) == ["r2"]
+    assert "TimeoutError" in job.errors["r2"]
+
+    # and the state of the others is kept for the next run
+    states = default_webhooks.SubscriptionStates(states_path)
+    states.load()
+    assert [name for name in names if states.get(name) is not None] == [
+        "r0",
+        "r1",
+        "r3",
+        "r4",
+    ]
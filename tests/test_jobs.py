@@ -0,0 +1,79 @@
+import asyncio
+
+from devops_console_rest_api.jobs import JobManager
+from devops_console_rest_api.models.jobs import JobStatus
+
+
+def make_job_manager(path, processed, interrupt_at=None) -> JobManager:
+    jobs = JobManager(str(path))
+
+    @jobs.register("process")
+    async def process(job, jobs):
+        if not job.items:
+            jobs.set_items(job, ["a", "b", "c", "d"])
+        for item in job.pending_items():
+            if item == interrupt_at:
+                await asyncio.sleep(3600)
+            processed.append(item)
+            jobs.mark(job, item, error="boom" if item == "b" else None)
+
+    return jobs
+
+
+async def wait_until_finished(jobs, job_id):
+    while not jobs.get(job_id).finished:
+        await asyncio.sleep(0.01)
+
+
+def test_interrupted_job_resumes_where_it_stopped(tmp_path):
+    processed = []
+
+    async def interrupted():
+        jobs = make_job_manager(tmp_path, processed, interrupt_at="c")
+        job = jobs.start("process")
+        while len(processed) < 2:
+            await asyncio.sleep(0.01)
+        return job.id
+        # the job is cancelled when the loop shuts down, like on a restart
+
+    job_id = asyncio.run(interrupted())
+    assert processed == ["a", "b"]
+
+    jobs = make_job_manager(tmp_path, processed)
+    assert jobs.load() == 1
+
+    async def resumed():
+        await jobs.resume()
+        await wait_until_finished(jobs, job_id)
+
+    asyncio.run(resumed())
+
+    # only the pending items were processed again
+    assert processed == ["a", "b", "c", "d"]
+    summary = jobs.get(job_id).summary()
+    assert summary.status == JobStatus.done
+    assert (summary.done, summary.failed, summary.pending) == (3, 1, 0)
+    assert summary.errors == {"b": "boom"}
+
+    # finished jobs are kept on disk (until they expire)
+    assert make_job_manager(tmp_path, processed).load() == 0
+    assert JobManager(str(tmp_path), retention=0).load() == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_finished_jobs_expire(tmp_path):
+    jobs = make_job_manager(tmp_path, [])
+
+    async def run():
+        job = jobs.start("process")
+        await wait_until_finished(jobs, job.id)
+        return job
+
+    job = asyncio.run(run())
+    assert jobs.list() == [job]
+
+    # forgotten once expired, without waiting for a restart
+    jobs.retention = 0
+    assert jobs.list() == []
+    assert jobs.get(job.id) is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,144 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+from fastapi.testclient import TestClient
+import pytest
+
+from devops_console_rest_api.jobs import JobManager
+from devops_console_rest_api.models.jobs import Job
+from devops_console_rest_api.models.webhooks import WebhookEventKey
+from devops_console_rest_api.webhooks_server import app as app_module
+from devops_console_rest_api.webhooks_server import journal as journal_module
+from devops_console_rest_api.webhooks_server.deliveries import Deliveries
+from devops_console_rest_api.webhooks_server.journal import Journal
+from devops_console_rest_api.webhooks_server.work_queue import WorkQueue
+
+from . import fixtures
+from .fixtures import mock_bitbucket_client
+
+
+def append(journal, n):
+    async def run():
+        return await asyncio.gather(
+            *[journal.append("repo:push", b'{"n": %d}' % i) for i in range(n)]
+        )
+
+    return asyncio.run(run())
+
+
+def test_interrupted_events_are_handled_again(tmp_path):
+    journal = Journal(str(tmp_path), segment_size=100)
+    assert append(journal, 3) == [0, 1, 2]
+    # appended together, synced together
+    assert journal.syncs == 1
+    assert append(journal, 3) == [3, 4, 5]
+
+    for offset in (0, 1, 3):
+        journal.done(offset)
+    journal.save_committed()
+    assert journal.committed == 1
+
+    # an event being written when the process died
+    *_, (_, last) = journal._segments()
+    with open(last, "ab") as f:
+        f.write(b'{"offset": 6, "received')
+
+    restarted = Journal(str(tmp_path), segment_size=100)
+    restarted.open()
+    # 3 was handled, but after 2 which wasn't: it's handled again
+    assert [record.offset for record in restarted.backlog()] == [2, 3, 4, 5]
+    assert restarted.stats()["backlog"] == 4
+    assert append(restarted, 1) == [6]
+    # rotated every 100 bytes
+    assert len(restarted._segments()) > 2
+
+
+def test_failed_sync(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path))
+
+    def fail(fd):
+        raise OSError("I/O error")
+
+    monkeypatch.setattr(journal_module, "_sync", fail)
+    with pytest.raises(OSError):
+        append(journal, 2)
+
+    monkeypatch.undo()
+    assert append(journal, 2) == [2, 3]
+    journal.done(2)
+    journal.done(3)
+    # the failed events don't hold the committed offset back
+    assert journal.committed == 3
+    assert journal.stats()["backlog"] == 0
+
+
+def test_read_time_range(tmp_path):
+    journal = Journal(str(tmp_path), segment_size=100)
+    append(journal, 5)
+    received_at = [record.received_at for record in journal.read()]
+
+    records = journal.read(since=received_at[1], until=received_at[3])
+    assert [record.offset for record in records] == [1, 2, 3]
+    records = journal.read(after=2)
+    assert [record.body for record in records] == [b'{"n": 3}', b'{"n": 4}']
+
+
+def test_received_events_are_journaled(mock_bitbucket_client, tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path))
+    monkeypatch.setattr(app_module, "journal", journal)
+    body = json.dumps(fixtures.mock_repopushevent)
+
+    response = TestClient(app_module.app).post(
+        "/", headers={"X-Event-Key": WebhookEventKey.repo_push.value}, data=body
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    [record] = journal.read()
+    assert (record.event_key, record.body) == ("repo:push", body.encode())
+
+
+def test_replay(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path))
+    monkeypatch.setattr(app_module, "journal", journal)
+    append(journal, 4)
+    received_at = [record.received_at for record in journal.read()]
+
+    replayed = []
+
+    async def handle(event_key, body):
+        replayed.append(body)
+
+    job = Job(
+        id="test",
+        kind=app_module.REPLAY,
+        params={"since": received_at[1], "until": None},
+    )
+
+    async def run():
+        queue = WorkQueue(handle)
+        queue.start()
+        monkeypatch.setattr(app_module, "work_queue", queue)
+        await app_module.replay(job, JobManager(""))
+        await queue.join()
+
+    asyncio.run(run())
+
+    assert replayed == [b'{"n": 1}', b'{"n": 2}', b'{"n": 3}']
+    assert job.result == {"offset": 3, "replayed": 3}
+
+
+def test_deliveries_are_remembered_across_restarts(
+    mock_bitbucket_client, tmp_path, monkeypatch
+):
+    journal = Journal(str(tmp_path))
+    asyncio.run(journal.append("repo:push", b"{}", delivery="hook/request"))
+    journal.done(0)
+
+    deliveries = Deliveries()
+    monkeypatch.setattr(app_module, "journal", Journal(str(tmp_path)))
+    monkeypatch.setattr(app_module, "deliveries", deliveries)
+    asyncio.run(app_module.recover_webhook_events())
+
+    assert deliveries.seen("hook/request")
+    assert not deliveries.seen("hook/other")
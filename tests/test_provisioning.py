@@ -0,0 +1,170 @@
+import asyncio
+from http import HTTPStatus
+
+from devops_console_rest_api import provisioning
+from devops_console_rest_api.api.v1.endpoints import bitbucket as bitbucket_endpoints
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.config import API_V1_STR, WEBHOOKS_URL
+from devops_console_rest_api.jobs import JobManager, job_manager
+from devops_console_rest_api.models.jobs import Job
+from devops_console_rest_api.ratelimit import RateLimiter
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from .fixtures import (
+    mock_bitbucket_client,
+    mock_configorprivilegevalue,
+    mock_projectvalue,
+)
+
+app = FastAPI()
+bb_endpoint = API_V1_STR + "/bb"
+app.include_router(bitbucket_endpoints.router, prefix=bb_endpoint)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeApi:
+    """Creates repositories; some calls fail, once or for good."""
+
+    def __init__(self, unavailable=(), invalid=(), timing_out=()):
+        self.unavailable = set(unavailable)
+        self.invalid = set(invalid)
+        self.timing_out = set(timing_out)
+        self.created = []
+        self.subscribed = []
+
+    async def add_repository(self, repository, template, template_params, args):
+        name = repository["name"]
+        if name in self.invalid:
+            raise UpstreamError(HTTPStatus.BAD_REQUEST)
+        self.created.append(name)
+        return {"name": name}
+
+    async def create_webhook_subscription(
+        self, repo_name, url, active, events, description, args
+    ):
+        if repo_name in self.unavailable:
+            self.unavailable.remove(repo_name)
+            raise UpstreamError(HTTPStatus.SERVICE_UNAVAILABLE)
+        self.subscribed.append(repo_name)
+        if repo_name in self.timing_out:
+            # subscribed, but the response is lost
+            self.timing_out.remove(repo_name)
+            raise asyncio.TimeoutError()
+        return {"uuid": repo_name, "url": url}
+
+    async def get_webhook_subscriptions(self, repo_name):
+        return {
+            "values": [
+                {"uuid": name, "url": WEBHOOKS_URL}
+                for name in self.subscribed
+                if name == repo_name
+            ]
+        }
+
+
+def payload(name):
+    return {
+        "name": name,
+        "project": mock_projectvalue,
+        "configuration": mock_configorprivilegevalue,
+        "privileges": mock_configorprivilegevalue,
+    }
+
+
+def setup(monkeypatch, api):
+    for name in (
+        "add_repository",
+        "create_webhook_subscription",
+        "get_webhook_subscriptions",
+    ):
+        monkeypatch.setattr(bitbucket_client, name, getattr(api, name), raising=False)
+    monkeypatch.setattr(provisioning, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(provisioning, "webhooks_rate_limiter", RateLimiter(100, 1))
+    refreshes = []
+    monkeypatch.setattr(
+        provisioning.repositories_cache, "refresh", lambda: refreshes.append(1)
+    )
+    return refreshes
+
+
+def test_provision_batch(mock_bitbucket_client, monkeypatch):
+    names = [f"repo-{i}" for i in range(8)]
+    api = FakeApi(
+        unavailable={"repo-1", "repo-5"}, invalid={"repo-3"}, timing_out={"repo-6"}
+    )
+    refreshes = setup(monkeypatch, api)
+
+    job = Job(
+        id="test",
+        kind=provisioning.PROVISION,
+        params={"repositories": [payload(name) for name in names]},
+    )
+    asyncio.run(provisioning.provision_batch(job, JobManager("")))
+
+    summary = job.summary()
+    assert (summary.done, summary.failed, summary.pending) == (7, 1, 0)
+    assert summary.errors == {"repo-3": "create_repository: 400"}
+
+    # the transient errors were retried, the invalid repository went no further
+    assert sorted(api.created) == sorted(set(names) - {"repo-3"})
+    # a subscription that timed out once made isn't made again
+    assert sorted(api.subscribed) == sorted(api.created)
+    assert job.result["outputs"]["repo-6"]["subscribe_webhooks"] == {
+        "uuid": "repo-6",
+        "url": WEBHOOKS_URL,
+    }
+    assert job.result["steps"]["repo-1"] == {
+        "create_repository": "done",
+        "subscribe_webhooks": "done",
+        "refresh_catalog": "done",
+    }
+    assert job.result["steps"]["repo-3"] == {
+        "create_repository": "failed",
+        "subscribe_webhooks": "pending",
+        "refresh_catalog": "pending",
+    }
+    assert job.result["outputs"]["repo-0"]["create_repository"] == {"name": "repo-0"}
+    assert len(refreshes) == 7
+
+
+def test_provision_skips_the_steps_already_done(mock_bitbucket_client, monkeypatch):
+    api = FakeApi()
+    setup(monkeypatch, api)
+
+    # eg: interrupted after creating the repository
+    outputs = {"create_repository": {"name": "repo"}}
+    repo = provisioning.RepositoryPost.parse_obj(payload("repo"))
+    asyncio.run(provisioning.provision(repo, outputs))
+
+    assert api.created == []
+    assert api.subscribed == ["repo"]
+    assert set(outputs) == {step.name for step in provisioning.STEPS}
+
+
+def test_create_repository(mock_bitbucket_client, monkeypatch):
+    api = FakeApi()
+    setup(monkeypatch, api)
+    client = TestClient(app)
+
+    response = client.post(bb_endpoint + "/repos", json=payload("repo"))
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"name": "repo"}
+    assert api.subscribed == ["repo"]
+
+    # posted again: the existing subscription is kept rather than duplicated
+    response = client.post(bb_endpoint + "/repos", json=payload("repo"))
+    assert response.status_code == HTTPStatus.OK
+    assert api.subscribed == ["repo"]
+
+    # the next steps take too long: answered with the job running them
+    monkeypatch.setattr(bitbucket_endpoints, "PROVISIONING_WAIT", 0)
+    response = client.post(bb_endpoint + "/repos", json=payload("other"))
+    assert response.status_code == HTTPStatus.ACCEPTED
+    job = job_manager.get(response.json()["id"])
+    assert job.kind == provisioning.PROVISION
+    assert job.result["steps"]["other"]["create_repository"] == "done"
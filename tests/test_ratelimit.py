@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime
+from http import HTTPStatus
+from uuid import uuid4
+
+from devops_console_rest_api import default_webhooks
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.jobs import JobManager
+from devops_console_rest_api.models.jobs import Job
+from devops_console_rest_api.ratelimit import RateLimiter
+
+from .fixtures import mock_bitbucket_client, mock_repository
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock jumps to the next timer instead of waiting for it."""
+
+    def __init__(self):
+        super().__init__()
+        self._now = 0.0
+        select = self._selector.select
+
+        def skip_ahead(timeout=None):
+            if timeout:
+                self._now += timeout
+            return select(0)
+
+        self._selector.select = skip_ahead
+
+    def time(self) -> float:
+        return self._now
+
+
+class RateLimited(Exception):
+    status = HTTPStatus.TOO_MANY_REQUESTS
+    headers = {"Retry-After": "120"}
+
+
+class FakeWebhooksApi:
+    """Records when each call is made; the first call for some repos gets a 429."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, rate_limited: set):
+        self.loop = loop
+        self.rate_limited = set(rate_limited)
+        self.calls = []
+
+    def _call(self, repo_name: str) -> None:
+        self.calls.append(self.loop.time())
+        if repo_name in self.rate_limited:
+            self.rate_limited.remove(repo_name)
+            raise RateLimited()
+
+    async def get_webhook_subscriptions(self, repo_name):
+        self._call(repo_name)
+        return {"values": []}
+
+    async def create_webhook_subscription(
+        self, repo_name, url, active, events, description
+    ):
+        self._call(repo_name)
+        return {
+            "uuid": uuid4().hex,
+            "url": url,
+            "description": description,
+            "subject": {"type": "repository"},
+            "active": active,
+            "created_at": datetime.now(),
+            "events": events,
+        }
+
+
+def test_subscribing_default_webhooks_stays_within_budget(
+    mock_bitbucket_client, monkeypatch
+):
+    budget, period = 100, 3600
+    names = [f"repo-{i}" for i in range(120)]
+
+    loop = VirtualTimeLoop()
+    api = FakeWebhooksApi(loop, rate_limited={"repo-7", "repo-50", "repo-51"})
+    limiter = RateLimiter(budget, period, burst=10, clock=loop.time)
+
+    async def get_repositories():
+        return [
+            {**mock_repository, "uuid": uuid4().hex, "name": name} for name in names
+        ]
+
+    for name in ("get_webhook_subscriptions", "create_webhook_subscription"):
+        monkeypatch.setattr(bitbucket_client, name, getattr(api, name))
+    monkeypatch.setattr(bitbucket_client, "get_repositories", get_repositories)
+    monkeypatch.setattr(default_webhooks, "webhooks_rate_limiter", limiter)
+
+    job = Job(id="test", kind=default_webhooks.SUBSCRIBE)
+    try:
+        loop.run_until_complete(default_webhooks.subscribe(job, JobManager("")))
+    finally:
+        loop.close()
+
+    assert job.summary().done == len(names)
+    # every repository twice, plus the 3 calls rejected with a 429
+    assert len(api.calls) == 2 * len(names) + 3
+    assert limiter.stats()["rate_limited"] == 3
+
+    # no window of `period` seconds sees more than `budget` calls...
+    calls = sorted(api.calls)
+    for i, start in enumerate(calls):
+        assert sum(1 for t in calls[i:] if t < start + period) <= budget
+
+    # ...but most of it is used: after the burst of 10, 90 calls per period
+    assert calls[-1] < (len(calls) - 10) / 90 * period + 120
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from devops_console_rest_api.webhooks_server.events import Event
+from devops_console_rest_api.webhooks_server.registry import HandlerRegistry
+
+
+def test_handlers_are_isolated():
+    handlers = HandlerRegistry(timeout=0.1)
+    handled = []
+
+    @handlers.register("repo:push", "repo:updated")
+    async def refresh_cache(event):
+        await asyncio.sleep(0.01)
+        handled.append(("refresh_cache", event.key))
+
+    @handlers.register("repo:push")
+    def notify(event):
+        handled.append(("notify", event.key))
+
+    @handlers.register("repo:push")
+    async def failing(event):
+        raise ValueError("boom")
+
+    @handlers.register("repo:push")
+    async def slow(event):
+        await asyncio.sleep(10)
+        handled.append(("slow", event.key))
+
+    @handlers.register("repo:push", timeout=1)
+    async def patient(event):
+        await asyncio.sleep(0.2)
+        handled.append(("patient", event.key))
+
+    assert "repo:push" in handlers
+    assert "pullrequest:created" not in handlers
+
+    start = time.monotonic()
+    asyncio.run(handlers.dispatch(Event("repo:push", {})))
+    # concurrently: as long as the slowest handler within its timeout
+    assert time.monotonic() - start < 0.5
+
+    assert sorted(handled) == [
+        ("notify", "repo:push"),
+        ("patient", "repo:push"),
+        ("refresh_cache", "repo:push"),
+    ]
+
+    stats = {name.rsplit(".", 1)[-1]: value for name, value in handlers.stats().items()}
+    assert stats["failing"]["failures"] == 1
+    assert stats["slow"]["timeouts"] == 1
+    assert stats["slow"]["latency"]["max"] < 0.5
+    assert stats["patient"]["latency"]["count"] == 1
+    assert stats["patient"]["timeouts"] == 0
@@ -1,10 +1,19 @@
+import asyncio
 from http import HTTPStatus
 import json
+import time
+from uuid import uuid4
 from devops_console_rest_api.api.v1.endpoints.bitbucket import router
 from devops_console_rest_api.config import API_V1_STR
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from .fixtures import mock_bitbucket_client, mock_repositorypost, mock_repositoryput
+from .fixtures import (
+    bridged_bitbucket_client,
+    mock_bitbucket_client,
+    mock_repository,
+    mock_repositorypost,
+    mock_repositoryput,
+)
 
 app = FastAPI()
 
@@ -20,6 +29,153 @@ def test_get_repos(mock_bitbucket_client):
     assert response.status_code == HTTPStatus.OK
 
 
+async def asgi_get(path):
+    """GET through the app on the running loop (the test client runs its own)."""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("test", 1234),
+        "server": ("test", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"]
+
+
+def test_get_repos_concurrent(bridged_bitbucket_client):
+    """Parallel calls must overlap rather than queue behind each other."""
+    n = 10
+
+    async def get_all():
+        start = time.perf_counter()
+        statuses = await asyncio.gather(
+            *[asgi_get(bb_endpoint + "/repos") for _ in range(n)]
+        )
+        assert statuses == [HTTPStatus.OK] * n
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(get_all())
+
+    # serialized calls would take n * delay
+    assert elapsed < n * bridged_bitbucket_client.delay / 2
+
+
+def test_get_repos_not_modified(mock_bitbucket_client):
+    response = client.get(bb_endpoint + "/repos")
+    etag = response.headers["ETag"]
+
+    response = client.get(bb_endpoint + "/repos", headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.content == b""
+
+    response = client.get(bb_endpoint + "/repos", headers={"If-None-Match": '"old"'})
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_get_repos_paginated(mock_bitbucket_client):
+    response = client.get(bb_endpoint + "/repos?project=test&pagelen=5&sort=-name")
+    assert response.status_code == HTTPStatus.OK
+    body = response.json()
+    assert body["size"] == 1
+    assert body["page"] == 1
+    assert body["next"] is None
+    assert [repo["name"] for repo in body["values"]] == ["test"]
+
+    response = client.get(bb_endpoint + "/repos?project=unknown")
+    assert response.json()["size"] == 0
+    assert response.json()["values"] == []
+
+
+def test_get_repos_ndjson(mock_bitbucket_client):
+    response = client.get(
+        bb_endpoint + "/repos", headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.content.splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["test"]
+
+
+def test_get_repos_fields(mock_bitbucket_client):
+    response = client.get(bb_endpoint + "/repos?fields=name,project.key")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [{"name": "test", "project": {"key": "test"}}]
+
+    response = client.get(bb_endpoint + "/repos?fields=nonexisting")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_get_repos_compressed(mock_bitbucket_client, monkeypatch):
+    monkeypatch.setattr("devops_console_rest_api.compression.COMPRESSION_MIN_SIZE", 0)
+    plain = client.get(bb_endpoint + "/repos", headers={"Accept-Encoding": "identity"})
+
+    response = client.get(bb_endpoint + "/repos", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.json() == plain.json()  # decoded by the client
+
+    # the weak ETag still matches, and is the one sent back
+    response = client.get(
+        bb_endpoint + "/repos",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]},
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+
+
+def test_search_repos(mock_bitbucket_client):
+    response = client.get(bb_endpoint + "/repos/search?q=tes")
+    assert response.status_code == HTTPStatus.OK
+    body = response.json()
+    assert body["size"] == 1
+    assert [repo["name"] for repo in body["values"]] == ["test"]
+
+    response = client.get(bb_endpoint + "/repos/search?q=test+nonexisting")
+    assert response.json()["size"] == 0
+
+
+def test_batch_get_repos(mock_bitbucket_client, monkeypatch):
+    from devops_console_rest_api.client import bitbucket_client
+
+    fetched = []
+
+    async def get_repository(repository=None, args=None):
+        fetched.append(repository)
+        if repository == "nonexisting":
+            raise LookupError(repository)
+        return {**mock_repository, "uuid": uuid4().hex, "name": repository}
+
+    monkeypatch.setattr(bitbucket_client, "get_repository", get_repository)
+
+    client.get(bb_endpoint + "/repos")  # caches "test"
+    response = client.post(
+        bb_endpoint + "/repos:batchGet?fields=name",
+        json={"names": ["test", "other", "nonexisting"]},
+    )
+    assert response.status_code == HTTPStatus.OK
+    test, other, nonexisting = response.json()["values"]
+    assert test == {"name": "test", "repository": {"name": "test"}}
+    assert other == {"name": "other", "repository": {"name": "other"}}
+    assert nonexisting["error"]["status"] == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert sorted(fetched) == ["nonexisting", "other"]
+
+
 def test_get_repository_by_name(mock_bitbucket_client):
     response = client.get(bb_endpoint + "/repos/test")
     assert response.status_code == HTTPStatus.OK
@@ -74,12 +230,20 @@ def test_get_webhook_subscriptions(mock_bitbucket_client):
 
 def test_create_default_webhooks(mock_bitbucket_client):
     response = client.get(bb_endpoint + "/repos/create_default_webhooks")
+    assert response.status_code == HTTPStatus.ACCEPTED
+    job = response.json()
+
+    response = client.get(bb_endpoint + f"/jobs/{job['id']}")
     assert response.status_code == HTTPStatus.OK
+    assert response.json()["kind"] == "create_default_webhooks"
 
 
 def test_remove_default_webhooks(mock_bitbucket_client):
     response = client.get(bb_endpoint + "/repos/remove_default_webhooks")
-    assert response.status_code == HTTPStatus.OK
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+    response = client.get(bb_endpoint + "/jobs/nonexisting")
+    assert response.status_code == HTTPStatus.NOT_FOUND
 
 
 def test_get_projects(mock_bitbucket_client):
@@ -0,0 +1,77 @@
+import asyncio
+from uuid import uuid4
+
+from devops_console_rest_api.cache import RepositoryCache
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.models.bitbucket import Repository
+from devops_console_rest_api.search import RepositorySearchIndex
+
+from .fixtures import mock_project, mock_repository
+
+
+def make_repository(name: str, project: str = "test") -> Repository:
+    return Repository.parse_obj(
+        {
+            **mock_repository,
+            "uuid": uuid4().hex,
+            "name": name,
+            "full_name": f"test/{name}",
+            "project": {**mock_project, "key": project, "name": f"{project} team"},
+        }
+    )
+
+
+def test_search_follows_the_cache():
+    cache = RepositoryCache()
+    index = RepositorySearchIndex()
+    index.attach(cache)
+
+    api, web, worker = (
+        make_repository("orders-api", "SHOP"),
+        make_repository("orders-web", "SHOP"),
+        make_repository("billing-worker", "PAY"),
+    )
+    cache.sync([api, web, worker])
+
+    assert [repo.name for repo in index.search("orders")[1]] == [
+        "orders-api",
+        "orders-web",
+    ]
+    # fragments, across fields, best match first
+    assert [repo.name for repo in index.search("ord shop")[1]] == [
+        "orders-api",
+        "orders-web",
+    ]
+    assert index.search("bill pay")[1] == [worker]
+    assert index.search("api web") == (0, [])
+
+    # a renamed repository is reindexed, a removed one is unindexed
+    cache.put(api.copy(update={"name": "checkout-api"}))
+    cache.invalidate(web.uuid)
+    assert index.search("orders") == (0, [])
+    assert [repo.name for repo in index.search("checkout")[1]] == ["checkout-api"]
+    assert "orders" not in index.postings
+
+
+def test_failed_refresh_keeps_repository_searchable(monkeypatch):
+    cache = RepositoryCache()
+    index = RepositorySearchIndex()
+    index.attach(cache)
+    api = make_repository("orders-api")
+    cache.put(api)
+
+    async def get_repository(repository=None, args=None):
+        raise ConnectionError("Bitbucket is down")
+
+    monkeypatch.setattr(
+        bitbucket_client, "get_repository", get_repository, raising=False
+    )
+
+    async def refresh():
+        await cache.refresh(api.uuid)
+
+    asyncio.run(refresh())
+
+    # still served (and found) as it was
+    assert cache.lookup(name="orders-api") == api
+    assert index.search("orders")[1] == [api]
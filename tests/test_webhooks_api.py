@@ -1,9 +1,18 @@
+import asyncio
 import json
 from http import HTTPStatus
+from uuid import uuid4
 
-from devops_console_rest_api.models.webhooks import WebhookEventKey
-from devops_console_rest_api.webhooks_api.api import app
+from devops_console_rest_api.cache import RepositoryCache
+from devops_console_rest_api.client import bitbucket_client
+from devops_console_rest_api.models.webhooks import RepoPushEvent, WebhookEventKey
+from devops_console_rest_api.webhooks_server import app as app_module
+from devops_console_rest_api.webhooks_server.app import app, handle_repo_push
+from devops_console_rest_api.webhooks_server.deliveries import Deliveries
+from devops_console_rest_api.webhooks_server.events import Event
+from devops_console_rest_api.webhooks_server.work_queue import WorkQueue
 from fastapi.testclient import TestClient
+import pytest
 
 from . import fixtures
 from .fixtures import mock_bitbucket_client
@@ -37,6 +46,203 @@ def test_handle_webhook_event_repo_push(mock_bitbucket_client):
     assert response.status_code == HTTPStatus.OK
 
 
+def test_handle_webhook_event_queue_full(monkeypatch):
+    monkeypatch.setattr(app_module.work_queue, "full", lambda: True)
+
+    response = client.post(
+        "/",
+        headers={"X-Event-Key": WebhookEventKey.repo_push.value},
+        data=json.dumps(fixtures.mock_repopushevent),
+    )
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"]
+
+
+def test_handle_webhook_event_duplicate_delivery(mock_bitbucket_client, monkeypatch):
+    queued = []
+    monkeypatch.setattr(
+        app_module.work_queue, "put", lambda *event: queued.append(event) or True
+    )
+    headers = {
+        "X-Event-Key": WebhookEventKey.repo_push.value,
+        "X-Hook-UUID": str(uuid4()),
+        "X-Request-UUID": str(uuid4()),
+    }
+    body = json.dumps(fixtures.mock_repopushevent)
+
+    for _ in range(3):
+        response = client.post("/", headers=headers, data=body)
+        assert response.status_code == HTTPStatus.OK
+    # delivered again by Bitbucket, but not handled again...
+    assert len(queued) == 1
+    assert client.get("/stats").json()["deliveries"]["duplicates"] == 2
+
+    # ...unlike another delivery of the same event
+    response = client.post(
+        "/", headers={**headers, "X-Request-UUID": str(uuid4())}, data=body
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert len(queued) == 2
+
+
+def test_handle_webhook_event_refused_delivery_is_retried(
+    mock_bitbucket_client, monkeypatch
+):
+    monkeypatch.setattr(app_module.work_queue, "full", lambda: True)
+    headers = {
+        "X-Event-Key": WebhookEventKey.repo_push.value,
+        "X-Request-UUID": str(uuid4()),
+    }
+    body = json.dumps(fixtures.mock_repopushevent)
+
+    response = client.post("/", headers=headers, data=body)
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+    monkeypatch.setattr(app_module.work_queue, "full", lambda: False)
+    monkeypatch.setattr(app_module.work_queue, "put", lambda *event: True)
+    response = client.post("/", headers=headers, data=body)
+    assert response.status_code == HTTPStatus.OK
+    assert app_module.deliveries.duplicates == 0
+
+
+def test_handle_webhook_event_failed_delivery_is_retried(
+    mock_bitbucket_client, monkeypatch
+):
+    async def append(*event):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(app_module.journal, "append", append)
+    headers = {
+        "X-Event-Key": WebhookEventKey.repo_push.value,
+        "X-Request-UUID": str(uuid4()),
+    }
+    body = json.dumps(fixtures.mock_repopushevent)
+
+    with pytest.raises(OSError):
+        client.post("/", headers=headers, data=body)
+
+    # the journal is back
+    del app_module.journal.append
+    queued = []
+    monkeypatch.setattr(
+        app_module.work_queue, "put", lambda *event: queued.append(event) or True
+    )
+    response = client.post("/", headers=headers, data=body)
+    assert response.status_code == HTTPStatus.OK
+    assert len(queued) == 1
+
+
+def test_deliveries_window():
+    now = [0.0]
+    deliveries = Deliveries(window=60, maxsize=3, clock=lambda: now[0])
+
+    assert not deliveries.seen("a")
+    assert deliveries.seen("a")
+    now[0] = 61
+    # too old to be a retry
+    assert not deliveries.seen("a")
+
+    for key in "bcd":
+        assert not deliveries.seen(key)
+    # at most 3 deliveries are remembered: "a" is the oldest
+    assert deliveries.stats() == {"size": 3, "duplicates": 1}
+    assert not deliveries.seen("a")
+
+
+def test_get_stats():
+    response = client.get("/stats")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["queue"]["maxsize"] == app_module.work_queue.maxsize
+
+
+def test_work_queue_acks_before_handling():
+    handled = []
+
+    async def run():
+        release = asyncio.Event()
+
+        async def handle(event_key, body):
+            await release.wait()
+            handled.append(body)
+            if body == b"2":
+                raise ValueError("boom")
+
+        queue = WorkQueue(handle, maxsize=2, workers=1)
+        queue.start()
+        # queued right away although the worker is stuck on the first event
+        accepted = [queue.put("repo:push", str(i).encode()) for i in range(4)]
+        await asyncio.sleep(0)
+        accepted.append(queue.put("repo:push", b"4"))
+        assert queue.stats()["depth"] == 2
+
+        release.set()
+        await queue.join()
+        return accepted, queue.stats()
+
+    accepted, stats = asyncio.run(run())
+
+    # the worker picked up the first event after the 2 first puts
+    assert accepted == [True, True, False, False, True]
+    assert handled == [b"0", b"1", b"4"]
+    assert (stats["depth"], stats["busy"]) == (0, 0)
+    assert (stats["received"], stats["refused"]) == (3, 2)
+    assert (stats["handled"], stats["failed"]) == (3, 0)
+    assert stats["wait"]["count"] == stats["handling"]["count"] == 3
+
+
+def test_handle_repo_push_refreshes_pushed_repository_only(
+    mock_bitbucket_client, monkeypatch
+):
+    pushed = {
+        **fixtures.mock_repository,
+        "uuid": fixtures.mock_payloadrepository["uuid"],
+    }
+    other = {
+        **fixtures.mock_repository,
+        "uuid": uuid4().hex,
+        "name": "other",
+        "full_name": "test/other",
+    }
+
+    cache = RepositoryCache()
+    cache.put(pushed)
+    cache.put(other)
+    monkeypatch.setattr(app_module, "repository_cache", cache)
+
+    fetched = []
+
+    async def get_repository(repository=None, args=None):
+        fetched.append(repository)
+        return {**pushed, "size": 0}
+
+    monkeypatch.setattr(bitbucket_client, "get_repository", get_repository)
+
+    async def push():
+        await handle_repo_push(event=Event("repo:push", fixtures.mock_repopushevent))
+        await asyncio.sleep(0.01)  # let the background refresh run
+
+    asyncio.run(push())
+
+    assert fetched == ["test"]
+    assert cache.lookup(uuid=pushed["uuid"]).size == 0
+    assert cache.lookup(uuid=other["uuid"]).size == other["size"]
+
+
+def test_event_routing_fields():
+    body = json.dumps(fixtures.mock_repopushevent).encode()
+    event = Event.parse(WebhookEventKey.repo_push.value, body)
+
+    assert event.repository_uuid == fixtures.mock_payloadrepository["uuid"]
+    assert event.branches == ["test"]
+    assert event.commit is None
+    # validated only when asked for
+    assert "model" not in vars(event)
+    assert isinstance(event.model, RepoPushEvent)
+    assert event.model.push["changes"][0].new.name == "test"
+
+
 def test_handle_webhook_event_repo_build_created(mock_bitbucket_client):
     # TODO: implement
     pass